@@ -1,16 +1,21 @@
+import logging
 from flask import Flask, jsonify, request
 from flask_cors import CORS
+from sqlalchemy import func
 
+from config import Config
 from utils.document_processor import DocumentProcessor
-from utils.vector_database import VectorDatabaseManager
+from utils.vector_database import get_vector_db
 from database.connection import db_manager
 from database.models import Document, QAHistory
 
+logging.basicConfig(level=Config.LOG_LEVEL)
+
 app = Flask(__name__)
 CORS(app)
 
 # Initialize processors
-vector_db = VectorDatabaseManager()
+vector_db = get_vector_db()
 document_processor = DocumentProcessor()
 
 @app.route('/api/vector/list', methods=['GET'])
@@ -112,7 +117,7 @@ def list_vector_data():
 
         # Fetch document details from SQL database
         if doc_ids_to_fetch:
-            with db_manager.get_session() as session:
+            with db_manager.session_scope() as session:
                 documents = session.query(Document).filter(
                     Document.document_id.in_(list(doc_ids_to_fetch))
                 ).all()
@@ -142,21 +147,20 @@ def list_vector_data():
 def list_sqlite_data():
     """API endpoint untuk list semua data di SQLite Database"""
     try:
-        with db_manager.get_session() as session:
-            # Get all documents
-            documents = session.query(Document).all()
+        with db_manager.session_scope() as session:
+            # Get all documents with their QA history counts in a single grouped query
+            rows = session.query(Document, func.count(QAHistory.id)).outerjoin(
+                QAHistory, QAHistory.document_id == Document.document_id
+            ).group_by(Document.document_id).all()
             
             documents_data = []
-            for doc in documents:
-                # Get QA history count
-                qa_count = session.query(QAHistory).filter(
-                    QAHistory.document_id == doc.document_id
-                ).count()
-                
+            for doc, qa_count in rows:
                 doc_info = {
                     'document_id': doc.document_id,
                     'filename': doc.filename,
                     'filepath': doc.filepath,
+                    'page_count': doc.page_count,
+                    'status': doc.status or Document.STATUS_READY,
                     'uploaded_at': doc.uploaded_at.isoformat() if doc.uploaded_at else None,
                     'qa_history_count': qa_count
                 }
@@ -175,6 +179,7 @@ def list_sqlite_data():
                     'response_time': qa.response_time,
                     'similarity_score': qa.similarity_score,
                     'page_references': qa.page_references,
+                    'status': qa.status,
                     'created_at': qa.created_at.isoformat() if qa.created_at else None
                 }
                 qa_data.append(qa_info)
@@ -203,7 +208,7 @@ def health_check():
     """Health check endpoint"""
     try:
         # Check database connection
-        with db_manager.get_session() as session:
+        with db_manager.session_scope() as session:
             from sqlalchemy import text
             session.execute(text("SELECT 1"))
         
@@ -1,13 +1,16 @@
 import os
 import time
 import math
+import logging
 import pytz
 import streamlit as st
 from config import Config
 from database.connection import db_manager
 from database.models import Document, QAHistory
-from utils.document_processor import DocumentProcessor
-from utils.vector_database import VectorDatabaseManager
+from utils.document_processor import DocumentProcessor, page_image_path
+from utils.vector_database import get_vector_db
+
+logging.basicConfig(level=Config.LOG_LEVEL)
 
 JAKARTA_TZ = pytz.timezone('Asia/Jakarta')
 
@@ -51,7 +54,9 @@ def initialize_processor():
     try:
         Config.validate_config()
         processor = DocumentProcessor()
-        vector_db = VectorDatabaseManager()
+        # Antrian ingestion tidak bertahan saat restart: dokumen yang tertinggal ditandai gagal
+        processor.fail_interrupted_documents()
+        vector_db = get_vector_db()
         return processor, vector_db
     except Exception as e:
         error_message = f"❌ Gagal menginisialisasi komponen: {e}"
@@ -78,7 +83,7 @@ def create_sidebar():
         st.markdown("---")
 
         try:
-          with db_manager.get_session() as session:
+          with db_manager.session_scope() as session:
               documents = session.query(Document).order_by(Document.uploaded_at.desc()).all()
           
           if not documents:
@@ -99,7 +104,7 @@ def create_sidebar():
               # Handle delete confirmation in sidebar
               if st.session_state.get('selected_document_id'):
                   if st.button("🗑️ Hapus Dokumen Terpilih", use_container_width=True, help="Hapus dokumen yang aktif saat ini", key="delete_selected_doc"):
-                      with db_manager.get_session() as session:
+                      with db_manager.session_scope() as session:
                           doc_to_delete_obj = session.query(Document).filter(Document.document_id == st.session_state.selected_document_id).first()
                       if doc_to_delete_obj:
                           st.session_state.doc_to_delete = doc_to_delete_obj
@@ -141,12 +146,17 @@ def render_upload_page():
     uploaded_file = st.file_uploader("Pilih file PDF", type=['pdf'], help="Upload file PDF yang ingin dianalisis")
     
     if uploaded_file is not None:
-        # Check file size (10MB limit)
-        file_size = len(uploaded_file.getvalue()) / (1024 * 1024)  # Convert to MB
+        # Check file size (10MB limit) from the upload metadata, without copying the buffer
+        file_size = uploaded_file.size / (1024 * 1024)  # Convert to MB
         if file_size > Config.MAX_FILE_SIZE:
             st.error(f"❌ File terlalu besar! Maksimal {Config.MAX_FILE_SIZE}MB. Ukuran file Anda: {file_size:.2f}MB")
             return
         
+        # Cheap header check instead of parsing the whole document
+        if uploaded_file.getbuffer()[:5].tobytes() != b'%PDF-':
+            st.error("❌ File bukan PDF yang valid")
+            return
+        
         st.info(f"📄 File: {uploaded_file.name} ({file_size:.2f}MB)")
         
         if st.button("🚀 Upload & Analisis", type="primary", use_container_width=True):
@@ -167,12 +177,12 @@ def render_upload_page():
                     
                     # Save the file
                     with open(saved_filepath, 'wb') as f:
-                        f.write(uploaded_file.getvalue())
+                        f.write(uploaded_file.getbuffer())
                     
-                    # Process document using the saved file
-                    document_id = processor.process_pdf_document(saved_filepath, document_id)
+                    # Queue document processing in the background using the saved file
+                    document_id = processor.enqueue_pdf_document(saved_filepath, document_id)
                     
-                    st.success(f"✅ Dokumen berhasil diproses!")
+                    st.success(f"✅ Dokumen berhasil diunggah dan sedang diproses!")
                     st.info(f"📋 ID Dokumen: `{document_id}`")
                     st.session_state.document_processed = True
                     st.session_state.selected_document_id = document_id
@@ -194,6 +204,14 @@ def render_chat_page(doc_id):
         st.error("❌ Dokumen tidak ditemukan")
         return
     
+    if doc_info['status'] == Document.STATUS_FAILED:
+        st.error(f"❌ Gagal memproses dokumen **{doc_info['filename']}**. Silakan upload ulang.")
+        return
+    if doc_info['status'] != Document.STATUS_READY:
+        st.info(f"⏳ Dokumen **{doc_info['filename']}** sedang diproses ({doc_info['status']})...")
+        time.sleep(2)
+        st.rerun()
+    
     st.info(f"📄 **{doc_info['filename']}** | 📊 {doc_info['page_count']} halaman | 📅 {doc_info['uploaded_at']}")
     st.caption(f"🆔 Document ID: `{doc_info['document_id']}`")
     
@@ -220,7 +238,7 @@ def render_qa_history(document_id):
     st.subheader("📚 Riwayat Tanya Jawab")
     
     try:
-        with db_manager.get_session() as session:
+        with db_manager.session_scope() as session:
             qa_records = session.query(QAHistory).filter(
                 QAHistory.document_id == document_id
             ).order_by(QAHistory.created_at.desc()).limit(5).all()  # Limit to 5 most recent
@@ -274,13 +292,12 @@ def render_document_preview(doc_id, doc_info):
     # Show current pages with expanders
     for i in range(start_idx, end_idx):
         page_data = pages_data[i]
-        # Construct PNG file path
-        png_filename = f"{doc_id}_page_{page_data['page_number']}.png"
-        png_filepath = os.path.join("storage/documents", doc_id, png_filename)
+        # Locate the rendered page image
+        png_filepath = page_image_path(doc_id, page_data['page_number'])
         
         with st.expander(f"📄 Halaman {page_data['page_number']} ({len(page_data['elements'])} element)"):
             # Show PNG image if exists
-            if os.path.exists(png_filepath):
+            if png_filepath:
                 element_types = [element['element_type'] for element in page_data['elements']]
                 st.write(f"**Element Type:** {', '.join(element_types)}")
 
@@ -373,15 +390,20 @@ def render_chat_interface(doc_id):
                         st.session_state.last_sources = {}
                     st.session_state.last_sources[doc_id] = similar_elements
 
-                    # Simpan ke database (skor tidak disimpan di DB saat ini, bisa ditambahkan jika perlu)
-                    with db_manager.get_session() as session:
-                        qa_record = QAHistory(
-                            document_id=doc_id, question=prompt, answer=response,
-                            response_time=f"{response_time:.2f}s",
-                            similarity_score=avg_score
-                        )
-                        session.add(qa_record)
-                        session.commit()
+                    # Simpan ke database; jawaban dari cache QAHistory tidak disimpan ulang,
+                    # dan hanya jawaban sukses yang dipakai ulang untuk pertanyaan yang sama
+                    if not result.get('cached'):
+                        answered = bool(result.get('success'))
+                        with db_manager.session_scope() as session:
+                            qa_record = QAHistory(
+                                document_id=doc_id, question=prompt, answer=response,
+                                response_time=f"{response_time:.2f}s",
+                                similarity_score=avg_score,
+                                page_references=[s.get('page_number') for s in similar_elements],
+                                status=QAHistory.STATUS_ANSWERED if answered else QAHistory.STATUS_FAILED,
+                                sources=similar_elements if answered else None
+                            )
+                            session.add(qa_record)
 
                     st.rerun()
                     
@@ -427,10 +449,9 @@ def render_chat_interface(doc_id):
                         
                         # Show page image if available
                         if page_number != 'N/A':
-                            png_filename = f"{doc_id}_page_{page_number}.png"
-                            png_filepath = os.path.join("storage/documents", doc_id, png_filename)
+                            png_filepath = page_image_path(doc_id, page_number)
                             
-                            if os.path.exists(png_filepath):
+                            if png_filepath:
                                 st.image(png_filepath, use_container_width=True, caption=f"Halaman {page_number}")
                             else:
                                 st.warning(f"Gambar tidak tersedia untuk halaman {page_number}")
@@ -455,7 +476,7 @@ def delete_document(document_id):
 def delete_qa_history(qa_id):
     """Delete a QA history record"""
     try:
-        with db_manager.get_session() as session:
+        with db_manager.session_scope() as session:
             qa_record = session.query(QAHistory).filter(QAHistory.id == qa_id).first()
             if qa_record:
                 session.delete(qa_record)
@@ -12,7 +12,7 @@ class Config:
     DATABASE_NAME = os.getenv('DATABASE_NAME', 'document_analysis_qa.db')
     
     # Vector Database Configuration
-    VECTOR_DB_PATH = os.getenv('VECTOR_DB_PATH', './vector_db')
+    VECTOR_DB_PATH = os.getenv('VECTOR_DB_PATH', os.path.join('storage', 'vector_db'))
     
     # Streamlit Configuration
     APP_TITLE = "Flow Document Q&A Assistant"
@@ -22,6 +22,88 @@ class Config:
     MODEL_NAME = "gemini-2.0-flash"  # Supports multimodal (text + image)
     EMBEDDING_MODEL = "text-embedding-004"
     
+    # Transcode page images to WebP before upload (set RECOMPRESS_IMAGES=true to enable)
+    RECOMPRESS_IMAGES = os.getenv('RECOMPRESS_IMAGES', 'false').lower() in ('1', 'true', 'yes')
+    RECOMPRESS_QUALITY = 90
+    
+    # Maximum number of pages analyzed concurrently by Gemini
+    PAGE_ANALYSIS_CONCURRENCY = int(os.getenv('PAGE_ANALYSIS_CONCURRENCY', 10))
+    
+    # Shared HTTP connection pool for the Gemini client
+    HTTP_MAX_CONNECTIONS = 100
+    HTTP_MAX_KEEPALIVE_CONNECTIONS = 50
+    # Multiplex concurrent requests over HTTP/2 (needs the h2 package; set HTTP2_ENABLED=false to disable)
+    HTTP2_ENABLED = os.getenv('HTTP2_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+    
+    # Extraction cache (set EXTRACTION_CACHE_ENABLED=false to disable)
+    CACHE_DIR = os.getenv('CACHE_DIR', os.path.join('storage', 'cache'))
+    EXTRACTION_CACHE_ENABLED = os.getenv('EXTRACTION_CACHE_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+    
+    # Answer cache (set ANSWER_CACHE_ENABLED=false to disable), TTL in seconds
+    ANSWER_CACHE_ENABLED = os.getenv('ANSWER_CACHE_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+    ANSWER_CACHE_TTL = int(os.getenv('ANSWER_CACHE_TTL', 7 * 24 * 60 * 60))
+    
+    # Client-side rate limits (requests per second) for Gemini endpoints
+    GENERATE_REQUESTS_PER_SECOND = 10
+    EMBED_REQUESTS_PER_SECOND = 25
+    
+    # Number of texts sent per embed_content request
+    EMBED_BATCH_SIZE = 32
+    # Approximate token budget per embed_content request (~4 characters per token)
+    EMBED_BATCH_MAX_CHARS = 60000
+    
+    # Maximum number of context characters sent to Gemini when answering questions
+    MAX_CONTEXT_CHARS = 24000
+    
+    # Texts shorter than this (after stripping) are not sent for embedding
+    MIN_EMBED_CHARS = 4
+    # Extracted document elements shorter than this (or with fewer alphanumeric characters) are treated as noise and not indexed
+    MIN_ELEMENT_CHARS = 8
+    MIN_ELEMENT_ALNUM = 4
+    
+    # Recreate the Chroma collection (losing its data) when storage errors are detected
+    AUTO_RESET_ON_CORRUPTION = os.getenv('AUTO_RESET_ON_CORRUPTION', 'false').lower() in ('1', 'true', 'yes')
+    # On full reset, move the old store aside as a backup; set to false to delete it in place instead
+    PRESERVE_CORRUPT_BACKUP = os.getenv('PRESERVE_CORRUPT_BACKUP', 'true').lower() in ('1', 'true', 'yes')
+    
+    # HNSW parameters for new Chroma collections (existing collections keep theirs until reset)
+    HNSW_M = 24
+    HNSW_EF_CONSTRUCTION = 200
+    HNSW_EF_SEARCH = 100
+    HNSW_BATCH_SIZE = 128
+    HNSW_SYNC_THRESHOLD = 1000
+    
+    # In-process cache of raw vector searches (entries, seconds); cleared on every add/delete
+    VECTOR_SEARCH_CACHE_SIZE = 1024
+    VECTOR_SEARCH_CACHE_TTL = 60
+    # Seconds between re-reading the real collection count behind the cached upper bound used to skip deletes
+    VECTOR_COUNT_RECONCILE_SECONDS = 300
+    
+    # Per-document embedding sidecars; documents up to this many elements are searched by brute force
+    EMBEDDINGS_DIR = os.path.join("storage", "embeddings")
+    BRUTE_FORCE_MAX_ELEMENTS = 2000
+    
+    # Maximum number of embeddings kept in the in-memory LRU cache
+    EMBEDDING_CACHE_SIZE = 4096
+    
+    # Maximum number of (document, question) search results kept in the in-memory LRU cache
+    SEARCH_CACHE_SIZE = 1024
+    
+    # Logging level for application modules (DEBUG logs prompts and response structure)
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+    
+    # PDF rasterization: zoom factor and number of worker processes
+    # (capped at 4 by default: each worker holds a full-page pixmap and gains flatten beyond that)
+    # 2x zoom (~144 DPI) is enough for the vision model to read body text
+    PDF_RENDER_ZOOM = float(os.getenv('PDF_RENDER_ZOOM', 2.0))
+    PDF_RENDER_WORKERS = int(os.getenv('PDF_RENDER_WORKERS', min(os.cpu_count() or 1, 4)))
+    # Page image format written at render time: "webp" (smaller, faster to encode), "jpeg" or "png"
+    PAGE_IMAGE_FORMAT = os.getenv('PAGE_IMAGE_FORMAT', 'webp').lower()
+    PAGE_IMAGE_QUALITY = 85
+    
+    # Number of documents ingested concurrently by the background ingestion queue
+    INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', 1))
+    
     # Maximum file size for uploads (in MB)
     MAX_FILE_SIZE = 10
     
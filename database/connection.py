@@ -1,7 +1,19 @@
 import os
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import StaticPool
+import orjson
+from contextlib import contextmanager
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import NullPool
+from database.models import Base
+
+
+def _configure_sqlite_connection(dbapi_connection, connection_record):
+    """WAL lets readers run alongside the background ingestion writer; writers wait instead of failing"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
+
 
 class DatabaseManager:
     def __init__(self):
@@ -20,11 +32,24 @@ class DatabaseManager:
             self.engine = create_engine(
                 f"sqlite:///{db_path}",
                 connect_args={"check_same_thread": False},
-                poolclass=StaticPool,
+                # Satu koneksi per session: thread UI dan worker ingestion tidak berbagi koneksi SQLite
+                poolclass=NullPool,
+                # JSON columns (e.g. QAHistory.page_references) go through orjson
+                json_serializer=lambda value: orjson.dumps(value).decode('utf-8'),
+                json_deserializer=orjson.loads,
                 echo=False
             )
             
-            self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+            event.listen(self.engine, "connect", _configure_sqlite_connection)
+            
+            # Thread-local sessions; objects stay usable after commit because
+            # the UI keeps ORM instances around (e.g. pending delete confirmations)
+            self.SessionLocal = scoped_session(sessionmaker(
+                autocommit=False,
+                autoflush=False,
+                expire_on_commit=False,
+                bind=self.engine
+            ))
             
             # Create tables
             self.create_tables()
@@ -36,51 +61,48 @@ class DatabaseManager:
             raise e
     
     def create_tables(self):
-        """Create database tables with new schema"""
+        """Create database tables from the ORM models"""
         try:
-            # Create tables using raw SQL for better control
-            with self.engine.connect() as conn:
-                # Create documents table
-                conn.execute(text("""
-                    CREATE TABLE IF NOT EXISTS documents (
-                        document_id VARCHAR(100) PRIMARY KEY,
-                        filename VARCHAR(255) NOT NULL,
-                        filepath TEXT NOT NULL,
-                        uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                """))
-                
-                # Create qa_history table
-                conn.execute(text("""
-                    CREATE TABLE IF NOT EXISTS qa_history (
-                        id VARCHAR PRIMARY KEY,
-                        document_id VARCHAR(100),
-                        question TEXT NOT NULL,
-                        answer TEXT NOT NULL,
-                        response_time VARCHAR(50),
-                        similarity_score FLOAT,
-                        page_references TEXT,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY (document_id) REFERENCES documents(document_id) ON DELETE CASCADE
-                    )
-                """))
-                
-                conn.commit()
-                print("Database tables created successfully")
-                
+            Base.metadata.create_all(bind=self.engine)
+            self._add_missing_columns()
+            print("Database tables created successfully")
+            
         except Exception as e:
             print(f"Error creating tables: {e}")
             raise e
     
-    def get_session(self):
-        """Get database session"""
-        return self.SessionLocal()
+    def _add_missing_columns(self):
+        """Add model columns and indexes missing from tables created by older schema versions"""
+        with self.engine.begin() as conn:
+            for table in Base.metadata.sorted_tables:
+                existing = {row[1] for row in conn.execute(text(f"PRAGMA table_info({table.name})"))}
+                for column in table.columns:
+                    if column.name in existing or column.primary_key:
+                        continue
+                    column_type = column.type.compile(dialect=self.engine.dialect)
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                    print(f"Added missing column {table.name}.{column.name}")
+                # create_all skips indexes of tables that already exist
+                for index in table.indexes:
+                    index.create(conn, checkfirst=True)
     
-    def close_session(self, session):
-        """Close database session"""
-        if session:
+    @contextmanager
+    def session_scope(self):
+        """Provide a transactional session scope: commit on success, rollback on error"""
+        session = self.SessionLocal()
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
             session.close()
 
+    def remove_session(self):
+        """Discard the current thread's scoped session (call when a worker thread finishes a job)"""
+        self.SessionLocal.remove()
+
 # Create global instance
 db_manager = DatabaseManager()
 
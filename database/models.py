@@ -1,17 +1,29 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Float
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Float, JSON, Index
+from sqlalchemy.orm import relationship, validates
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
 import uuid
+import hashlib
 
 Base = declarative_base()
 
 class Document(Base):
     __tablename__ = 'documents'
     
+    # Ingestion stages, in order
+    STATUS_PENDING = 'PENDING'
+    STATUS_RENDERING = 'RENDERING'
+    STATUS_EXTRACTING = 'EXTRACTING'
+    STATUS_EMBEDDING = 'EMBEDDING'
+    STATUS_READY = 'READY'
+    STATUS_FAILED = 'FAILED'
+    IN_PROGRESS_STATUSES = (STATUS_PENDING, STATUS_RENDERING, STATUS_EXTRACTING, STATUS_EMBEDDING)
+    
     document_id = Column(String(100), primary_key=True)
     filename = Column(String(255), nullable=False)
     filepath = Column(Text, nullable=False)
+    page_count = Column(Integer) # Set at ingest time so lookups need no filesystem scan
+    status = Column(String(20), default='READY') # Ingestion stage; NULL on rows created before it existed means READY
     uploaded_at = Column(DateTime, default=datetime.utcnow)
     
     # Relationships
@@ -23,17 +35,64 @@ class Document(Base):
 class QAHistory(Base):
     __tablename__ = 'qa_history'
     
+    # Answer outcome; only ANSWERED rows are replayed for repeated questions
+    STATUS_ANSWERED = 'ANSWERED'
+    STATUS_FAILED = 'FAILED'
+    
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     document_id = Column(String(100), ForeignKey('documents.document_id', ondelete='CASCADE'), nullable=False, index=True)
     question = Column(Text, nullable=False)
+    question_hash = Column(String(40)) # SHA1 of the normalized question, for exact re-ask lookups
     answer = Column(Text, nullable=False)
     response_time = Column(String(50))
     similarity_score = Column(Float)
-    page_references = Column(Text) # Store page numbers as comma-separated string or JSON
+    page_references = Column(JSON) # Store page numbers as JSON array, mirrored in qa_page_refs
+    status = Column(String(20)) # ANSWERED or FAILED; NULL on rows created before it existed (never replayed)
+    sources = Column(JSON) # Similar elements the answer was based on, returned again on exact re-asks
     created_at = Column(DateTime, default=datetime.utcnow)
     
     # Relationship with document
     document = relationship("Document", back_populates="qa_history")
+    page_refs = relationship("QAPageReference", back_populates="qa", cascade="all, delete-orphan")
+    
+    __table_args__ = (
+        Index('ix_qa_doc_qhash', 'document_id', 'question_hash'),
+    )
+    
+    @staticmethod
+    def hash_question(question):
+        """SHA1 of the lowercased, whitespace-collapsed question"""
+        normalized = " ".join(question.lower().split())
+        return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+    
+    @validates('question')
+    def _set_question_hash(self, key, question):
+        self.question_hash = self.hash_question(question)
+        return question
+    
+    @validates('page_references')
+    def _sync_page_refs(self, key, pages):
+        """Keep the indexed qa_page_refs rows in sync with the JSON page list"""
+        pages = list(dict.fromkeys(p for p in (pages or []) if p is not None))
+        self.page_refs = [QAPageReference(page_number=p) for p in pages]
+        return pages
+    
+    def __repr__(self):
+        return f"<QAHistory(id='{self.id}', question='{self.question[:50]}...')>"
+
+class QAPageReference(Base):
+    __tablename__ = 'qa_page_refs'
+    
+    qa_id = Column(String, ForeignKey('qa_history.id', ondelete='CASCADE'), primary_key=True)
+    page_number = Column(Integer, primary_key=True)
+    
+    # Relationship with QA history
+    qa = relationship("QAHistory", back_populates="page_refs")
+    
+    # Page lookups ("which QA references page P?") hit this index instead of scanning qa_history
+    __table_args__ = (
+        Index('ix_qa_page_refs_page_qa', 'page_number', 'qa_id'),
+    )
     
     def __repr__(self):
-        return f"<QAHistory(id='{self.id}', question='{self.question[:50]}...')>" 
\ No newline at end of file
+        return f"<QAPageReference(qa_id='{self.qa_id}', page_number={self.page_number})>"
@@ -1,194 +1,464 @@
-import time
-import random
+import os
+import logging
+import asyncio
+import functools
+import hashlib
+import threading
+import httpx
 from google.genai import Client, types
 from config import Config
-import base64
-import json
+import orjson
+from io import BytesIO
+from PIL import Image
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 from utils.function_call import STRUCTURED_EXTRACTION_TOOL
+from utils.extraction_cache import ExtractionCache
+from utils.answer_cache import AnswerCache
+from utils.resilience import CircuitBreaker, Retrier, TokenBucket
+
+__all__ = ['AIProcessor', 'get_ai_processor', 'get_client', 'run_coroutine']
+
+logger = logging.getLogger(__name__)
+
+# Prompt templates, dibangun sekali saat modul dimuat
+# Naikkan PROMPT_VERSION setiap kali prompt atau skema function call berubah
+PROMPT_VERSION = "1"
+PAGE_ANALYSIS_PROMPT = "Analisis halaman dokumen ini. Ekstrak seluruh teks dan identifikasi flowchart. Berikan juga penjelasan (explanation) yang mengidentifikasi jenis halaman (misalnya, cover, daftar isi, atau isi utama) dan konteksnya dalam dokumen. Gunakan function call `analyze_document_page` untuk mengembalikan hasilnya."
+
+ANSWER_PROMPT_TMPL = """Berdasarkan informasi dari dokumen berikut, jawablah pertanyaan yang diajukan.
+
+{context}
+
+---
+PERTANYAAN: {question}
+
+PETUNJUK JAWABAN:
+1. Jawab pertanyaan secara langsung, jelas, dan ringkas dalam Bahasa Indonesia.
+2. Sintesis informasi dari halaman-halaman yang disediakan untuk membentuk satu jawaban yang utuh dan koheren.
+3. Jika perlu merujuk pada informasi spesifik, sebutkan nomor halamannya secara natural (contoh: \"Menurut alur proses di halaman 9,..., Gambar 1. (15.X.1.1)\").
+
+JAWABAN:""".format
+
+# Konfigurasi ekstraksi yang sama untuk setiap halaman: paksa function call analyze_document_page
+_EXTRACTION_CONFIG = types.GenerateContentConfig(
+    tools=STRUCTURED_EXTRACTION_TOOL,
+    tool_config=types.ToolConfig(
+        function_calling_config=types.FunctionCallingConfig(mode='ANY')
+    )
+)
+_EXTRACTION_PROMPT_PART = types.Part.from_text(text=PAGE_ANALYSIS_PROMPT)
+
+
+# Ganti newline dengan spasi dalam satu pass
+_NL_TABLE = str.maketrans({'\n': ' ', '\r': ' '})
+
+
+def _iter_flowchart_parts(flowchart_content):
+    """Yield the cleaned text lines of a flowchart"""
+    if flowchart_content.get('title'):
+        yield flowchart_content['title'].translate(_NL_TABLE).strip()
+    
+    for node in flowchart_content.get('nodes', []):
+        yield f"Node ({node.get('shape', '')}): {node.get('label', '').translate(_NL_TABLE).strip()}"
+        
+    edges = flowchart_content.get('edges')
+    if edges:
+        yield "\nAlur:"
+        for edge in edges:
+            edge_text = f"  Dari {edge.get('from_node', '')} ke {edge.get('to_node', '')}"
+            if edge.get('label'):
+                edge_text += f" dengan label '{edge['label'].translate(_NL_TABLE).strip()}'"
+            yield edge_text
+    
+    if flowchart_content.get('explanation'):
+        yield f"\nPenjelasan: {flowchart_content['explanation'].translate(_NL_TABLE).strip()}"
+
+
+@functools.lru_cache(maxsize=64)
+def _build_context(context_key, max_chars):
+    """Render (page_number, element_type, plain_text) tuples into the per-page prompt context,
+    keeping pages in rank order until max_chars is reached"""
+    # Kelompokkan konteks berdasarkan nomor halaman, dengan prefix tipe elemen untuk kejelasan
+    context_by_page = defaultdict(list)
+    for page_number, element_type, plain_text in context_key:
+        context_by_page[page_number].append(''.join(('[', element_type, '] ', plain_text)))
+    # Buat teks konteks yang terstruktur per halaman, dibatasi max_chars
+    pages = list(context_by_page.items())
+    context_parts = []
+    total_chars = 0
+    for index, (page_number, contents) in enumerate(pages):
+        page_text = f"--- Informasi dari Halaman {page_number} ---\n" + "\n".join(contents)
+        if context_parts and total_chars + len(page_text) > max_chars:
+            dropped = len(pages) - index
+            logger.info("Context truncated at %d chars, dropped %d of %d pages", total_chars, dropped, len(pages))
+            context_parts.append(f"[...{dropped} halaman lainnya dipotong...]")
+            break
+        # Halaman dengan peringkat teratas selalu disertakan, dipotong bila melebihi batas
+        context_parts.append(page_text[:max_chars])
+        total_chars += len(page_text) + 2
+    return "\n\n".join(context_parts)
+
+
+def _page_label(page_image):
+    """Short description of a page image for log messages"""
+    if isinstance(page_image, (bytes, bytearray)):
+        return f"<{len(page_image)} bytes>"
+    return page_image
+
+
+# Gemini client bersama, dibuat sekali per proses
+_CLIENT = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def get_client():
+    """Return the process-wide Gemini client, creating it on first use"""
+    global _CLIENT
+    if _CLIENT is None:
+        with _CLIENT_LOCK:
+            if _CLIENT is None:
+                if not Config.GEMINI_API_KEY:
+                    raise ValueError("GEMINI_API_KEY tidak ditemukan")
+                # Satu pool koneksi keep-alive untuk semua panggilan sync dan async
+                limits = httpx.Limits(
+                    max_connections=Config.HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=Config.HTTP_MAX_KEEPALIVE_CONNECTIONS
+                )
+                client_args = {'limits': limits, 'http2': Config.HTTP2_ENABLED}
+                _CLIENT = Client(
+                    api_key=Config.GEMINI_API_KEY,
+                    http_options=types.HttpOptions(
+                        api_version='v1beta',
+                        client_args=client_args,
+                        async_client_args=client_args
+                    )
+                )
+                logger.info("Gemini client initialized (model: %s, embedding model: %s)", Config.MODEL_NAME, Config.EMBEDDING_MODEL)
+    return _CLIENT
+
+_LOOP = None
+_LOOP_LOCK = threading.Lock()
+
+
+def _get_loop():
+    """Return the process-wide event loop for Gemini aio calls, running on a daemon thread"""
+    global _LOOP
+    if _LOOP is None:
+        with _LOOP_LOCK:
+            if _LOOP is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="gemini-aio", daemon=True).start()
+                _LOOP = loop
+    return _LOOP
+
+
+def run_coroutine(coro):
+    """
+    Run coro on the shared event loop and wait for its result. The aio client's connection pool
+    is bound to the loop it first ran on, so every aio call must go through this one loop
+    (a fresh asyncio.run per call would leave the pool on a closed loop).
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop()).result()
+
+# Rate limiter bersama per endpoint; hanya menunggu saat kuota per detik habis
+_GENERATE_LIMITER = TokenBucket(rate=Config.GENERATE_REQUESTS_PER_SECOND, capacity=Config.GENERATE_REQUESTS_PER_SECOND * 2)
+_EMBED_LIMITER = TokenBucket(rate=Config.EMBED_REQUESTS_PER_SECOND, capacity=Config.EMBED_REQUESTS_PER_SECOND * 2)
+
 
 class AIProcessor:
     def __init__(self):
         self.client = None
+        self.aclient = None
+        self.retrier = Retrier()
+        # Satu breaker per endpoint agar gangguan embedding tidak menghentikan analisis halaman
+        self.generate_breaker = CircuitBreaker("generate_content")
+        self.embed_breaker = CircuitBreaker("embed_content")
+        self.generate_limiter = _GENERATE_LIMITER
+        self.embed_limiter = _EMBED_LIMITER
+        self.extraction_cache = ExtractionCache(Config.CACHE_DIR) if Config.EXTRACTION_CACHE_ENABLED else None
+        self.answer_cache = AnswerCache(os.path.join(Config.CACHE_DIR, 'qa'), Config.ANSWER_CACHE_TTL) if Config.ANSWER_CACHE_ENABLED else None
+        # LRU cache embedding: "task_type:sha256(text)" -> vector
+        self._embedding_cache = OrderedDict()
+        self._embedding_cache_lock = threading.Lock()
         self._initialize_client()
 
     def _initialize_client(self):
-        """Initialize Gemini client"""
+        """Attach the shared Gemini client"""
         try:
-            self.client = Client(
-                api_key=Config.GEMINI_API_KEY,
-                http_options={'api_version': 'v1beta'}
-            )
-            print("Gemini client initialized successfully")
-            if not Config.GEMINI_API_KEY:
-                raise ValueError("GEMINI_API_KEY tidak ditemukan")
-            print(f"Using model: {Config.MODEL_NAME}")
-            print(f"Using embedding model: {Config.EMBEDDING_MODEL}")
+            self.client = get_client()
+            self.aclient = self.client.aio
         except Exception as e:
-            print(f"Error initializing Gemini client: {e}")
+            logger.error("Error initializing Gemini client: %s", e)
             raise e
 
-    def _retry_with_backoff(self, func, max_retries=3, base_delay=1):
-        """Retry function with exponential backoff"""
-        for attempt in range(max_retries):
-            try:
-                return func()
-            except Exception as e:
-                # Retry untuk error 503 (overloaded) dan 500 (internal server error)
-                if "503" in str(e) or "UNAVAILABLE" in str(e) or "500" in str(e) or "INTERNAL" in str(e):
-                    if attempt < max_retries - 1:
-                        delay = base_delay * (2 ** attempt) + random.uniform(0, 1)
-                        error_type = "503/overloaded" if "503" in str(e) else "500/internal"
-                        print(f"API {error_type} error, retrying in {delay:.2f} seconds... (attempt {attempt + 1}/{max_retries})")
-                        time.sleep(delay)
-                        continue
-                    else:
-                        print(f"Max retries reached for API error: {e}")
-                        return None
-                else:
-                    print(f"Non-retryable error: {e}")
-                    return None
-        return None
+    def _retry_with_backoff(self, func, breaker=None):
+        """Call func with jittered retries (see utils.resilience.Retrier)"""
+        return self.retrier.call(func, breaker)
+
+    async def _retry_with_backoff_async(self, func, breaker=None):
+        """Async variant of _retry_with_backoff for coroutine functions"""
+        return await self.retrier.acall(func, breaker)
 
     def _flowchart_to_text(self, flowchart_content):
         """Converts flowchart JSON to a readable text format."""
-        parts = []
-        if flowchart_content.get('title'):
-            # Bersihkan newline dalam title
-            title = flowchart_content['title'].replace('\n', ' ').strip()
-            parts.append(title)
-        
-        for node in flowchart_content.get('nodes', []):
-            # Bersihkan newline dalam label node
-            label = node.get('label', '').replace('\n', ' ').strip()
-            parts.append(f"Node ({node.get('shape', '')}): {label}")
-            
-        if flowchart_content.get('edges'):
-            parts.append("\nAlur:")
-            for edge in flowchart_content.get('edges', []):
-                edge_text = f"  Dari {edge.get('from_node', '')} ke {edge.get('to_node', '')}"
-                if edge.get('label'):
-                    # Bersihkan newline dalam label edge
-                    edge_label = edge.get('label').replace('\n', ' ').strip()
-                    edge_text += f" dengan label '{edge_label}'"
-                parts.append(edge_text)
-        
-        if flowchart_content.get('explanation'):
-            # Bersihkan newline dalam explanation
-            explanation = flowchart_content['explanation'].replace('\n', ' ').strip()
-            parts.append(f"\nPenjelasan: {explanation}")
-            
-        return "\n".join(parts)
+        return "\n".join(_iter_flowchart_parts(flowchart_content))
 
     def _debug_response_structure(self, response):
-        """Debug helper to print response structure"""
-        print("🔍 Debug Response Structure:")
+        """Debug helper to log response structure (skipped entirely unless DEBUG is enabled)"""
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
         try:
             if response and response.candidates:
-                print(f"   Candidates count: {len(response.candidates)}")
+                logger.debug("Candidates count: %d", len(response.candidates))
                 candidate = response.candidates[0]
                 if candidate.content and candidate.content.parts:
-                    print(f"   Parts count: {len(candidate.content.parts)}")
+                    logger.debug("Parts count: %d", len(candidate.content.parts))
                     for i, part in enumerate(candidate.content.parts):
                         if hasattr(part, 'function_call') and part.function_call:
-                            print(f"   Part {i} function_call: {part.function_call.name}")
+                            logger.debug("Part %d function_call: %s", i, part.function_call.name)
             else:
-                print("   No candidates found.")
+                logger.debug("No candidates found.")
+        except Exception as e:
+            logger.debug("Error debugging response: %s", e)
+
+    def _read_png(self, page_image):
+        """Image bytes for a page given either its raw bytes or a file path"""
+        if isinstance(page_image, (bytes, bytearray)):
+            return bytes(page_image)
+        with open(page_image, 'rb') as f:
+            return f.read()
+
+    def _recompress_image(self, png_data):
+        """Transcode a PNG page to WebP when that makes the upload smaller"""
+        try:
+            with Image.open(BytesIO(png_data)) as img:
+                buffer = BytesIO()
+                img.save(buffer, 'WEBP', quality=Config.RECOMPRESS_QUALITY, method=6)
+            webp_data = buffer.getvalue()
+            if len(webp_data) < len(png_data):
+                logger.debug("Recompressed page image %d -> %d bytes", len(png_data), len(webp_data))
+                return webp_data, 'image/webp'
         except Exception as e:
-            print(f"   Error debugging response: {e}")
-        print("🔍 End Debug Response Structure")
+            logger.warning("Image recompression failed, sending original PNG: %s", e)
+        return png_data, 'image/png'
+
+    def _build_page_content(self, png_data):
+        """Build the multimodal request content for a PNG, WebP or JPEG page"""
+        if png_data[:4] == b'RIFF':
+            # Sudah WebP sejak rendering, tidak perlu transcoding
+            image_data, mime_type = png_data, 'image/webp'
+        elif png_data[:3] == b'\xff\xd8\xff':
+            image_data, mime_type = png_data, 'image/jpeg'
+        elif Config.RECOMPRESS_IMAGES:
+            image_data, mime_type = self._recompress_image(png_data)
+        else:
+            image_data, mime_type = png_data, 'image/png'
+        # SDK meng-encode bytes sendiri, tidak perlu base64 + decode manual
+        return types.Content(
+            role='user',
+            parts=[
+                types.Part.from_bytes(data=image_data, mime_type=mime_type),
+                _EXTRACTION_PROMPT_PART
+            ]
+        )
 
-    def process_png_page(self, png_filepath):
+    def _parse_extraction_response(self, response):
+        """Convert an analyze_document_page function call response into extracted elements"""
+        extracted_elements = []
+        self._debug_response_structure(response)
+        if response.candidates and response.candidates[0].content and response.candidates[0].content.parts:
+            for part in response.candidates[0].content.parts:
+                if hasattr(part, 'function_call') and part.function_call and part.function_call.name == 'analyze_document_page':
+                    # args sudah berupa dict Python di google-genai, tidak perlu disalin
+                    args = part.function_call.args or {}
+                    
+                    # 1. Ekstrak Teks (jika ada dan bukan null)
+                    extracted_text = args.get('extracted_text')
+                    if extracted_text:
+                        text_content = extracted_text.get('text', '').translate(_NL_TABLE).strip()
+                        explanation_content = extracted_text.get('explanation', '').translate(_NL_TABLE).strip()
+                        
+                        # Hanya tambahkan jika ada konten teks
+                        if text_content:
+                            # Gabungkan untuk embedding
+                            combined_plain_text = f"{text_content} \n\nPenjelasan: {explanation_content}".strip()
+                            # Simpan keduanya dalam JSON untuk referensi
+                            combined_content_json = {
+                                'text': text_content,
+                                'explanation': explanation_content
+                            }
+                            extracted_elements.append({
+                                'element_type': 'TEXT',
+                                'content_json': orjson.dumps(combined_content_json).decode('utf-8'),
+                                'plain_text': combined_plain_text  # Masih diperlukan untuk vector database
+                            })
+                    
+                    # 2. Ekstrak Flowchart (jika ada dan bukan null)
+                    flowchart_content = args.get('flowchart')
+                    if flowchart_content:
+                        # Periksa apakah flowchart memiliki konten yang valid
+                        if (flowchart_content.get('title') or 
+                            flowchart_content.get('nodes') or 
+                            flowchart_content.get('edges')):
+                            plain_text = self._flowchart_to_text(flowchart_content)
+                            if plain_text.strip():  # Hanya tambahkan jika ada konten
+                                extracted_elements.append({
+                                    'element_type': 'FLOWCHART',
+                                    'content_json': orjson.dumps(flowchart_content).decode('utf-8'),
+                                    'plain_text': plain_text  # Masih diperlukan untuk vector database
+                                })
+        logger.debug("Final extracted elements count: %d", len(extracted_elements))
+        return extracted_elements
+
+    def _cached_extraction_key(self, png_data):
+        """Cache key for a page image, or None when the extraction cache is disabled"""
+        if self.extraction_cache is None:
+            return None
+        return self.extraction_cache.make_key(png_data, Config.MODEL_NAME, PROMPT_VERSION)
+
+    def _get_cached_extraction(self, cache_key):
+        if cache_key is None:
+            return None
+        cached = self.extraction_cache.get(cache_key)
+        if cached is not None:
+            logger.debug("Extraction cache hit: %d elements", len(cached))
+        return cached
+
+    def _put_cached_extraction(self, cache_key, extracted_elements):
+        # Hasil kosong tidak disimpan agar halaman yang gagal dianalisis bisa dicoba lagi
+        if cache_key is not None and extracted_elements:
+            self.extraction_cache.put(cache_key, extracted_elements, Config.MODEL_NAME)
+
+    def process_png_page(self, page_image):
         """
-        Process a single PNG page to extract text, flowchart, and summary.
+        Process a single page image (raw bytes or file path) to extract text, flowchart, and summary.
         Returns:
-            list: A list of extracted elements.
+            list: A list of extracted elements, or None when the page could not be analyzed.
         """
         try:
-            with open(png_filepath, 'rb') as f:
-                png_data = f.read()
-            png_b64 = base64.b64encode(png_data).decode('utf-8')
-            extracted_elements = []
-            content = {
-                'role': 'user',
-                'parts': [
-                    {'inline_data': {'mime_type': 'image/png', 'data': png_b64}},
-                    {'text': 'Analisis halaman dokumen ini. Ekstrak seluruh teks dan identifikasi flowchart. Berikan juga penjelasan (explanation) yang mengidentifikasi jenis halaman (misalnya, cover, daftar isi, atau isi utama) dan konteksnya dalam dokumen. Gunakan function call `analyze_document_page` untuk mengembalikan hasilnya.'}
-                ]
-            }
+            png_data = self._read_png(page_image)
+            cache_key = self._cached_extraction_key(png_data)
+            cached = self._get_cached_extraction(cache_key)
+            if cached is not None:
+                return cached
+            content = self._build_page_content(png_data)
             def api_call():
+                self.generate_limiter.acquire()
                 return self.client.models.generate_content(
                     model=Config.MODEL_NAME,
                     contents=[content],
-                    config=types.GenerateContentConfig(
-                        tools=STRUCTURED_EXTRACTION_TOOL,
-                        tool_config=types.ToolConfig(
-                            function_calling_config=types.FunctionCallingConfig(mode='ANY')
-                        )
-                    )
+                    config=_EXTRACTION_CONFIG
                 )
-            response = self._retry_with_backoff(api_call)
+            response = self._retry_with_backoff(api_call, self.generate_breaker)
             if response is None:
-                print("Failed to get response after all retries")
-                return []
-            self._debug_response_structure(response)
-            if response.candidates and response.candidates[0].content and response.candidates[0].content.parts:
-                for part in response.candidates[0].content.parts:
-                    if hasattr(part, 'function_call') and part.function_call and part.function_call.name == 'analyze_document_page':
-                        args = dict(part.function_call.args)
-                        
-                        # 1. Ekstrak Teks (jika ada dan bukan null)
-                        if 'extracted_text' in args and args['extracted_text']:
-                            text_content = args['extracted_text'].get('text', '').replace('\n', ' ').strip()
-                            explanation_content = args['extracted_text'].get('explanation', '').replace('\n', ' ').strip()
-                            
-                            # Hanya tambahkan jika ada konten teks
-                            if text_content:
-                                # Gabungkan untuk embedding
-                                combined_plain_text = f"{text_content} \n\nPenjelasan: {explanation_content}".strip()
-                                # Simpan keduanya dalam JSON untuk referensi
-                                combined_content_json = {
-                                    'text': text_content,
-                                    'explanation': explanation_content
-                                }
-                                extracted_elements.append({
-                                    'element_type': 'TEXT',
-                                    'content_json': json.dumps(combined_content_json, ensure_ascii=False),
-                                    'plain_text': combined_plain_text  # Masih diperlukan untuk vector database
-                                })
-                        
-                        # 2. Ekstrak Flowchart (jika ada dan bukan null)
-                        if 'flowchart' in args and args['flowchart']:
-                            flowchart_content = args['flowchart']
-                            # Periksa apakah flowchart memiliki konten yang valid
-                            if (flowchart_content.get('title') or 
-                                flowchart_content.get('nodes') or 
-                                flowchart_content.get('edges')):
-                                plain_text = self._flowchart_to_text(flowchart_content)
-                                if plain_text.strip():  # Hanya tambahkan jika ada konten
-                                    extracted_elements.append({
-                                        'element_type': 'FLOWCHART',
-                                        'content_json': json.dumps(flowchart_content, ensure_ascii=False),
-                                        'plain_text': plain_text  # Masih diperlukan untuk vector database
-                                    })
-            print(f"Final extracted elements count: {len(extracted_elements)}")
+                logger.warning("Failed to get response after all retries")
+                return None
+            extracted_elements = self._parse_extraction_response(response)
+            self._put_cached_extraction(cache_key, extracted_elements)
+            return extracted_elements
+        except Exception as e:
+            logger.exception("Error processing PNG page")
+            return None
+
+    async def process_png_page_async(self, page_image):
+        """
+        Async variant of process_png_page using the client's aio interface (run it via run_coroutine).
+        Returns:
+            list: A list of extracted elements, or None when the page could not be analyzed.
+        """
+        page_label = _page_label(page_image)
+        try:
+            if isinstance(page_image, (bytes, bytearray)):
+                png_data = bytes(page_image)
+            else:
+                # Baca file di thread terpisah agar event loop tidak terblokir
+                png_data = await asyncio.to_thread(self._read_png, page_image)
+            cache_key = self._cached_extraction_key(png_data)
+            cached = self._get_cached_extraction(cache_key)
+            if cached is not None:
+                return cached
+            # Transcoding gambar memakai CPU, jalankan di luar event loop
+            content = await asyncio.to_thread(self._build_page_content, png_data)
+            async def api_call():
+                await self.generate_limiter.acquire_async()
+                return await self.aclient.models.generate_content(
+                    model=Config.MODEL_NAME,
+                    contents=[content],
+                    config=_EXTRACTION_CONFIG
+                )
+            response = await self._retry_with_backoff_async(api_call, self.generate_breaker)
+            if response is None:
+                logger.warning("Failed to get response after all retries for %s", page_label)
+                return None
+            extracted_elements = self._parse_extraction_response(response)
+            self._put_cached_extraction(cache_key, extracted_elements)
             return extracted_elements
         except Exception as e:
-            print(f"Error processing PNG page: {e}")
-            import traceback
-            traceback.print_exc()
-            return []
+            logger.exception("Error processing PNG page %s", page_label)
+            return None
+
+    def process_png_pages(self, page_images, max_workers=None):
+        """
+        Process several page images (bytes or paths) concurrently for synchronous callers, using a bounded thread pool.
+        Returns:
+            list: One list of extracted elements (None for failed pages) per input page, in input order.
+        """
+        with ThreadPoolExecutor(max_workers=max_workers or Config.PAGE_ANALYSIS_CONCURRENCY) as executor:
+            return list(executor.map(self.process_png_page, page_images))
+
+    async def process_png_pages_async(self, page_images, max_concurrency=None):
+        """
+        Process several page images (bytes or paths) concurrently, bounded by a semaphore.
+        Returns:
+            list: One list of extracted elements (None for failed pages) per input page, in input order.
+        """
+        semaphore = asyncio.Semaphore(max_concurrency or Config.PAGE_ANALYSIS_CONCURRENCY)
+
+        async def bounded(page_image):
+            async with semaphore:
+                return await self.process_png_page_async(page_image)
+
+        return await asyncio.gather(*[bounded(page_image) for page_image in page_images])
+
+    def _is_trivial_text(self, text):
+        """Texts too short to carry meaning; a zero vector would break cosine search, so they are not embedded"""
+        return len(text.strip()) < Config.MIN_EMBED_CHARS
+
+    def _embedding_cache_key(self, text, task_type):
+        return f"{task_type}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+    def _get_cached_embedding(self, cache_key):
+        with self._embedding_cache_lock:
+            embedding = self._embedding_cache.get(cache_key)
+            if embedding is not None:
+                self._embedding_cache.move_to_end(cache_key)
+            return embedding
+
+    def _put_cached_embedding(self, cache_key, embedding):
+        with self._embedding_cache_lock:
+            self._embedding_cache[cache_key] = embedding
+            self._embedding_cache.move_to_end(cache_key)
+            while len(self._embedding_cache) > Config.EMBEDDING_CACHE_SIZE:
+                self._embedding_cache.popitem(last=False)
 
     def generate_embeddings(self, text, task_type="RETRIEVAL_DOCUMENT"):
         """Generate embeddings for text using Gemini with retry logic"""
         try:
             # Validasi input text
             if not text or not text.strip():
-                print("Warning: Empty text provided for embedding generation")
+                logger.warning("Empty text provided for embedding generation")
+                return None
+            if self._is_trivial_text(text):
+                logger.debug("Skipping embedding for trivial text: %r", text)
                 return None
+            cache_key = self._embedding_cache_key(text, task_type)
+            cached = self._get_cached_embedding(cache_key)
+            if cached is not None:
+                return cached
             def embedding_api_call():
-                # Tambahkan delay kecil untuk menghindari rate limiting
-                time.sleep(0.1)
+                self.embed_limiter.acquire()
                 return self.client.models.embed_content(
                     model=Config.EMBEDDING_MODEL,
                     contents=[text],
@@ -196,67 +466,131 @@ class AIProcessor:
                         task_type=task_type,
                     )
                 )
-            response = self._retry_with_backoff(embedding_api_call)
+            response = self._retry_with_backoff(embedding_api_call, self.embed_breaker)
             if response is None:
-                print("Failed to generate embeddings after all retries")
+                logger.warning("Failed to generate embeddings after all retries")
                 return None
             # Based on the latest error log, the structure is response.embeddings[0].values
             if hasattr(response, 'embeddings') and response.embeddings and hasattr(response.embeddings[0], 'values'):
-                return response.embeddings[0].values
+                embedding = response.embeddings[0].values
+                self._put_cached_embedding(cache_key, embedding)
+                return embedding
             else:
-                print(f"Unexpected embedding response structure: {type(response)}")
-                print(f"Response content: {response}")
+                logger.warning("Unexpected embedding response structure: %s", type(response))
+                logger.debug("Response content: %s", response)
                 return None
         except Exception as e:
-            print(f"Error generating embeddings: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Error generating embeddings")
+            return None
+
+    def _iter_embedding_batches(self, pending):
+        """Split (index, text, cache_key) items into request batches bounded by count and characters"""
+        batch = []
+        batch_chars = 0
+        for item in pending:
+            text_chars = len(item[1])
+            if batch and (len(batch) >= Config.EMBED_BATCH_SIZE or batch_chars + text_chars > Config.EMBED_BATCH_MAX_CHARS):
+                yield batch
+                batch = []
+                batch_chars = 0
+            batch.append(item)
+            batch_chars += text_chars
+        if batch:
+            yield batch
+
+    def generate_embeddings_batch(self, texts, task_type="RETRIEVAL_DOCUMENT"):
+        """
+        Generate embeddings for many texts, batching up to Config.EMBED_BATCH_SIZE texts
+        (and Config.EMBED_BATCH_MAX_CHARS characters) per request.
+        Returns:
+            list: One vector per input text (None for empty texts or failed batches).
+        """
+        results = [None] * len(texts)
+        try:
+            # Lewati teks kosong dan yang sudah ada di cache
+            pending = []
+            for index, text in enumerate(texts):
+                if not text or self._is_trivial_text(text):
+                    continue
+                cache_key = self._embedding_cache_key(text, task_type)
+                cached = self._get_cached_embedding(cache_key)
+                if cached is not None:
+                    results[index] = cached
+                else:
+                    pending.append((index, text, cache_key))
+
+            for batch in self._iter_embedding_batches(pending):
+                def embedding_api_call():
+                    self.embed_limiter.acquire()
+                    return self.client.models.embed_content(
+                        model=Config.EMBEDDING_MODEL,
+                        contents=[text for _, text, _ in batch],
+                        config=types.EmbedContentConfig(
+                            task_type=task_type,
+                        )
+                    )
+                response = self._retry_with_backoff(embedding_api_call, self.embed_breaker)
+                if response is None or not getattr(response, 'embeddings', None) or len(response.embeddings) != len(batch):
+                    logger.warning("Failed to generate embeddings for batch of %d texts", len(batch))
+                    continue
+                for (index, _, cache_key), embedding in zip(batch, response.embeddings):
+                    results[index] = embedding.values
+                    self._put_cached_embedding(cache_key, embedding.values)
+            return results
+        except Exception as e:
+            logger.exception("Error generating batch embeddings")
+            return results
+
+    def call_gemini_api(self, prompt, cache_key=None):
+        """Send a text prompt to Gemini and return the first text part of the response, or None on failure"""
+        try:
+            content = {'role': 'user', 'parts': [{'text': prompt}]}
+            def api_call():
+                self.generate_limiter.acquire()
+                return self.client.models.generate_content(model=Config.MODEL_NAME, contents=[content])
+            # Jalur jawaban juga lewat retry dan circuit breaker, agar saat gangguan langsung gagal cepat
+            response = self._retry_with_backoff(api_call, self.generate_breaker)
+            if response is None:
+                logger.warning("Failed to get answer from Gemini after all retries")
+                return None
+            if response.candidates and response.candidates[0].content and response.candidates[0].content.parts:
+                answer = response.candidates[0].content.parts[0].text
+                # Hanya jawaban valid yang disimpan ke cache
+                if cache_key is not None and answer:
+                    self.answer_cache.put(cache_key, answer)
+                if answer:
+                    return answer
+            logger.warning("No valid response from Gemini")
+            return None
+        except Exception as e:
+            logger.error("Error calling Gemini API: %s", e)
             return None
 
     def answer_question(self, question, elements_context):
-        """Answer question based on elements context with a more natural response format."""
+        """Answer question based on elements context with a more natural response format; None when Gemini fails."""
         try:
             if not elements_context:
                 return "Maaf, tidak ada informasi yang relevan untuk menjawab pertanyaan Anda."
-            # Kelompokkan konteks berdasarkan nomor halaman
-            context_by_page = {}
-            for element in elements_context:
-                page_number = element.get('page_number', 'N/A')
-                if page_number not in context_by_page:
-                    context_by_page[page_number] = []
-                # Tambahkan prefix tipe elemen untuk kejelasan
-                element_text = f"[{element.get('element_type', 'UNKNOWN')}] {element.get('plain_text', '')}"
-                context_by_page[page_number].append(element_text)
-            # Buat teks konteks yang terstruktur per halaman
-            context_parts = []
-            for page_number, contents in context_by_page.items():
-                content_str = "\n".join(contents)
-                context_parts.append(f"--- Informasi dari Halaman {page_number} ---\n{content_str}")
-            context_text = "\n\n".join(context_parts)
-            prompt = f"""Berdasarkan informasi dari dokumen berikut, jawablah pertanyaan yang diajukan.
-
-{context_text}
-
----
-PERTANYAAN: {question}
+            context_key = tuple(
+                (element.get('page_number', 'N/A'), element.get('element_type', 'UNKNOWN'), element.get('plain_text', ''))
+                for element in elements_context
+            )
+            context_text = _build_context(context_key, Config.MAX_CONTEXT_CHARS)
+            cache_key = None
+            if self.answer_cache is not None:
+                cache_key = self.answer_cache.make_key(PROMPT_VERSION, context_text, question)
+                cached_answer = self.answer_cache.get(cache_key)
+                if cached_answer is not None:
+                    return cached_answer
+            prompt = ANSWER_PROMPT_TMPL(context=context_text, question=question)
+            logger.debug("prompt=%s", prompt)
+            return self.call_gemini_api(prompt, cache_key)
+        except Exception as e:
+            logger.error("Error answering question: %s", e)
+            return None
 
-PETUNJUK JAWABAN:
-1. Jawab pertanyaan secara langsung, jelas, dan ringkas dalam Bahasa Indonesia.
-2. Sintesis informasi dari halaman-halaman yang disediakan untuk membentuk satu jawaban yang utuh dan koheren.
-3. Jika perlu merujuk pada informasi spesifik, sebutkan nomor halamannya secara natural (contoh: \"Menurut alur proses di halaman 9,..., Gambar 1. (15.X.1.1)\").
 
-JAWABAN:"""
-            print(prompt)
-            # Inline call_gemini_api
-            try:
-                content = {'role': 'user', 'parts': [{'text': prompt}]}
-                response = self.client.models.generate_content(model=Config.MODEL_NAME, contents=[content])
-                if response.candidates and response.candidates[0].content and response.candidates[0].content.parts:
-                    return response.candidates[0].content.parts[0].text
-                return "Tidak ada respons yang valid dari AI."
-            except Exception as e:
-                print(f"Error calling Gemini API: {e}")
-                return f"Error: {str(e)}"
-        except Exception as e:
-            print(f"Error answering question: {e}")
-            return f"Maaf, terjadi kesalahan: {str(e)}"
+@functools.lru_cache(maxsize=1)
+def get_ai_processor():
+    """Process-wide AIProcessor shared by every DocumentProcessor (caches, limiters and breakers included)"""
+    return AIProcessor()
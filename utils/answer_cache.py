@@ -0,0 +1,59 @@
+import os
+import orjson
+import time
+import hashlib
+import tempfile
+
+
+class AnswerCache:
+    """On-disk cache of Gemini answers keyed by prompt version, context and question, with a TTL"""
+
+    def __init__(self, cache_dir, ttl_seconds):
+        self.cache_dir = cache_dir
+        self.ttl_seconds = ttl_seconds
+
+    def make_key(self, prompt_version, context_text, question):
+        normalized_question = " ".join(question.lower().split())
+        payload = f"{prompt_version}\0{context_text}\0{normalized_question}"
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key):
+        """Return the cached answer, or None on miss / expired entry"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                entry = orjson.loads(f.read())
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Error reading answer cache entry {key}: {e}")
+            return None
+
+        if entry.get('expires_at', 0) < time.time():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return entry.get('answer')
+
+    def put(self, key, answer):
+        """Store answer for key; written atomically so readers never see partial files"""
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            entry = {'answer': answer, 'expires_at': time.time() + self.ttl_seconds}
+            # Nama file sementara unik per penulis: thread lain bisa menulis key yang sama
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(orjson.dumps(entry))
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+        except Exception as e:
+            print(f"Error writing answer cache entry {key}: {e}")
@@ -1,71 +1,171 @@
 import os
+import re
+import shutil
 import uuid
+import threading
+import multiprocessing
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
 from PIL import Image
 import fitz  # PyMuPDF
-from sqlalchemy.orm import sessionmaker
+import numpy as np
+from config import Config
 from database.connection import db_manager
-from database.models import Document
-from utils.ai_processor import AIProcessor
-from utils.vector_database import VectorDatabaseManager
+from database.models import Document, QAHistory
+from utils.ai_processor import get_ai_processor, run_coroutine
+from utils.vector_database import get_vector_db
+from utils.embedding_store import EmbeddingStore
+from utils.pdf_renderer import iter_rendered_pages, render_pages
 import json
 
+# Ambang batas dan bobot untuk re-ranking hasil pencarian
+SIMILARITY_THRESHOLD = 0.5
+FLOWCHART_BOOST = 1.05
+
+# Pola untuk membersihkan nama file menjadi document ID
+_NON_ALNUM = re.compile(r'[^a-zA-Z0-9\s]')
+_WHITESPACE = re.compile(r'\s+')
+
+# Lokasi gambar halaman per dokumen: STORAGE_ROOT/<document_id>/<document_id>_page_<n>.<webp|jpg|png>
+STORAGE_ROOT = Path("storage/documents")
+PAGE_IMAGE_EXTENSIONS = ('.webp', '.jpg', '.png')
+_EXTENSION_BY_FORMAT = {'webp': 'webp', 'jpeg': 'jpg', 'png': 'png'}
+
+# Antrian ingestion di background agar upload tidak menunggu seluruh proses selesai
+_INGEST_EXECUTOR = ThreadPoolExecutor(max_workers=Config.INGEST_WORKERS, thread_name_prefix="ingest")
+# Penghapusan file halaman punya thread sendiri agar tidak mengantre di belakang ingestion
+_CLEANUP_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cleanup")
+
+# Worker rendering tidak di-fork dari proses yang sudah menjalankan banyak thread
+# (Streamlit, httpx, Chroma, ingestion): lock yang diwarisi saat fork bisa deadlock
+_RENDER_MP_CONTEXT = multiprocessing.get_context(
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+)
+
+# LRU hasil pencarian per (document_id, hash pertanyaan, top_k), dipakai bersama semua instance
+_SEARCH_CACHE = OrderedDict()
+_SEARCH_CACHE_LOCK = threading.Lock()
+
+
+class IngestCancelled(Exception):
+    """The document row was deleted while its ingestion job was still running"""
+
+
+def _is_embeddable(text):
+    """Cheap local check that an element's text carries enough signal to be worth embedding"""
+    stripped = text.strip()
+    return len(stripped) >= Config.MIN_ELEMENT_CHARS and sum(c.isalnum() for c in stripped) >= Config.MIN_ELEMENT_ALNUM
+
+
+def _best_per_page(distances, is_flowchart, page_numbers, limit):
+    """
+    Score Chroma cosine distances (with the flowchart boost) and return up to `limit`
+    (index, score) pairs above SIMILARITY_THRESHOLD, best first, at most one per page.
+    """
+    scores = 1 - np.asarray(distances, dtype=np.float64)
+    scores = np.where(is_flowchart, np.minimum(scores * FLOWCHART_BOOST, 1.0), scores)
+    above = scores > SIMILARITY_THRESHOLD
+    scores = np.round(scores, 3)
+    
+    picked = []
+    seen_pages = set()
+    for i in np.argsort(-scores, kind='stable'):
+        if not above[i] or page_numbers[i] in seen_pages:
+            continue
+        seen_pages.add(page_numbers[i])
+        picked.append((int(i), float(scores[i])))
+        if len(picked) == limit:
+            break
+    return picked
+
+
+def page_image_path(document_id, page_number):
+    """Path of a rendered page image (WebP, JPEG or legacy PNG), or None if it does not exist"""
+    for extension in PAGE_IMAGE_EXTENSIONS:
+        path = STORAGE_ROOT / document_id / f"{document_id}_page_{page_number}{extension}"
+        if path.exists():
+            return str(path)
+    return None
+
+
 class DocumentProcessor:
     def __init__(self):
-        self.ai_processor = AIProcessor()
-        self.vector_db = VectorDatabaseManager()
+        self.ai_processor = get_ai_processor()
+        self.vector_db = get_vector_db()
+        self.embedding_store = EmbeddingStore(Config.EMBEDDINGS_DIR, Config.BRUTE_FORCE_MAX_ELEMENTS)
         self.db_manager = db_manager
-        self.session = None
-        self._init_database_session()
-
-    def _init_database_session(self):
-        """Initialize database session"""
-        try:
-            self.session = db_manager.get_session()
-        except Exception as e:
-            print(f"Error initializing database session: {e}")
-            raise e
     
     def _create_png_directory(self, document_id):
         """Create directory for PNG files"""
-        png_dir = os.path.join("storage/documents", document_id)
-        os.makedirs(png_dir, exist_ok=True)
+        png_dir = STORAGE_ROOT / document_id
+        png_dir.mkdir(parents=True, exist_ok=True)
         return png_dir
     
     def _convert_pdf_to_png(self, pdf_path, png_dir, document_id):
-        """Convert PDF pages to PNG files"""
+        """
+        Convert PDF pages to image files (Config.PAGE_IMAGE_FORMAT), rendering page groups in parallel worker processes.
+        Returns [(page_number, image_bytes)] in page order so callers need not read the files back.
+        """
         try:
-            pdf_document = fitz.open(pdf_path)
-            page_count = len(pdf_document)
-            
-            for page_num in range(page_count):
-                page = pdf_document.load_page(page_num)
+            # Penulisan ke disk dilakukan thread terpisah agar rendering tidak menunggu I/O
+            write_futures = []
+            rendered = []
+            with fitz.open(pdf_path) as pdf_document, ThreadPoolExecutor(max_workers=1) as write_pool:
+                page_count = len(pdf_document)
                 
-                # Render page to image
-                mat = fitz.Matrix(3.0, 3.0)  # 2x zoom for better quality
-                pix = page.get_pixmap(matrix=mat)
+                def write_pages(rendered_pages):
+                    for page_index, png_data in rendered_pages:
+                        rendered.append((page_index + 1, png_data))
+                        png_filepath = png_dir / f"{document_id}_page_{page_index + 1}.{extension}"
+                        write_futures.append(write_pool.submit(png_filepath.write_bytes, png_data))
                 
-                # Save as PNG
-                png_filename = f"{document_id}_page_{page_num + 1}.png"
-                png_filepath = os.path.join(png_dir, png_filename)
-                pix.save(png_filepath)
+                image_format = Config.PAGE_IMAGE_FORMAT
+                extension = _EXTENSION_BY_FORMAT.get(image_format, 'png')
+                workers = min(Config.PDF_RENDER_WORKERS, page_count)
+                if workers <= 1:
+                    # Render langsung dari dokumen yang sudah dibuka, tanpa mem-parse PDF lagi
+                    write_pages(iter_rendered_pages(
+                        pdf_document, range(page_count), Config.PDF_RENDER_ZOOM, image_format, Config.PAGE_IMAGE_QUALITY
+                    ))
+                else:
+                    # Bagi halaman secara bergantian agar beban tiap worker seimbang
+                    page_groups = [list(range(worker, page_count, workers)) for worker in range(workers)]
+                    with ProcessPoolExecutor(max_workers=workers, mp_context=_RENDER_MP_CONTEXT) as executor:
+                        futures = [
+                            executor.submit(
+                                render_pages, pdf_path, group, Config.PDF_RENDER_ZOOM, image_format, Config.PAGE_IMAGE_QUALITY
+                            )
+                            for group in page_groups
+                        ]
+                        for future in as_completed(futures):
+                            write_pages(future.result())  # Re-raises the first rendering failure
+            
+            for future in write_futures:
+                future.result()  # Re-raise the first write failure
             
-            pdf_document.close()
-            return page_count
+            rendered.sort(key=lambda page: page[0])
+            return rendered
             
         except Exception as e:
             print(f"Error converting PDF to PNG: {e}")
             raise e
 
+    def _extract_pages(self, page_images):
+        """
+        Run AI extraction for all pages concurrently on the shared Gemini event loop,
+        returning results in page order (None for pages that could not be analyzed)
+        """
+        return run_coroutine(self.ai_processor.process_png_pages_async(page_images))
+
     def generate_document_id(self, filename):
         """Generate document ID in format: [nama]_[unique_rand]"""
         # Remove file extension
         name_without_ext = os.path.splitext(filename)[0]
         
         # Clean filename (remove special characters, replace spaces with underscore)
-        import re
-        clean_name = re.sub(r'[^a-zA-Z0-9\s]', '', name_without_ext)
-        clean_name = re.sub(r'\s+', '_', clean_name).strip('_')
+        clean_name = _NON_ALNUM.sub('', name_without_ext)
+        clean_name = _WHITESPACE.sub('_', clean_name).strip('_')
         
         # If clean_name is empty, use 'document'
         if not clean_name:
@@ -79,132 +179,221 @@ class DocumentProcessor:
         
         return document_id
 
+    def _create_document_record(self, pdf_path, document_id=None):
+        """Insert a PENDING Document row for pdf_path and return its document_id"""
+        # Get filename from path
+        filename = os.path.basename(pdf_path)
+        
+        if not document_id:
+            # Generate document ID using filename
+            document_id = self.generate_document_id(filename)
+        
+        # Create document record
+        with self.db_manager.session_scope() as session:
+            session.add(Document(
+                document_id=document_id,
+                filename=filename,
+                filepath=os.path.abspath(pdf_path),
+                status=Document.STATUS_PENDING
+            ))
+        return document_id
+
+    def _update_document(self, document_id, **values):
+        """Update the document row; raises IngestCancelled when it no longer exists (deleted mid-ingest)"""
+        with self.db_manager.session_scope() as session:
+            updated = session.query(Document).filter(
+                Document.document_id == document_id
+            ).update(values)
+        if not updated:
+            raise IngestCancelled(document_id)
+
+    def _discard_ingest_output(self, document_id):
+        """Remove whatever a cancelled ingestion job already wrote for a deleted document"""
+        self.vector_db.delete_document_embeddings(document_id)
+        self.embedding_store.delete(document_id)
+        self._invalidate_search_cache(document_id)
+        shutil.rmtree(STORAGE_ROOT / document_id, ignore_errors=True)
+
+    def fail_interrupted_documents(self):
+        """
+        Mark documents left mid-ingestion by a previous process as FAILED; the in-process queue
+        does not survive a restart, so nothing would ever finish them. Call once at startup.
+        """
+        with self.db_manager.session_scope() as session:
+            interrupted = session.query(Document).filter(
+                Document.status.in_(Document.IN_PROGRESS_STATUSES)
+            ).update({Document.status: Document.STATUS_FAILED}, synchronize_session=False)
+        if interrupted:
+            print(f"Marked {interrupted} interrupted document(s) as FAILED")
+        return interrupted
+
+    def enqueue_pdf_document(self, pdf_path, document_id=None):
+        """
+        Register a PDF document and ingest it on the background queue.
+        Returns the document_id immediately; poll get_document_info for its status.
+        """
+        document_id = self._create_document_record(pdf_path, document_id)
+        _INGEST_EXECUTOR.submit(self._run_ingest_job, document_id)
+        return document_id
+
+    def _run_ingest_job(self, document_id):
+        try:
+            self.ingest_document_job(document_id)
+        except IngestCancelled:
+            print(f"Ingestion of document {document_id} cancelled: document was deleted")
+        except Exception:
+            # Status FAILED sudah dicatat; tidak ada pemanggil yang menunggu hasil job ini
+            pass
+        finally:
+            # Lepaskan session thread-local milik worker ingestion
+            self.db_manager.remove_session()
+
     def process_pdf_document(self, pdf_path, document_id=None):
         """
-        Process a PDF document: convert to PNG pages, extract data, store in database
+        Process a PDF document synchronously: convert to PNG pages, extract data, store in database
         Returns the document_id
         """
-        try:
-            # Get filename from path
-            filename = os.path.basename(pdf_path)
-            
-            if not document_id:
-                # Generate document ID using filename
-                document_id = self.generate_document_id(filename)
-            
-            # Get file info
-            filepath = os.path.abspath(pdf_path)
+        document_id = self._create_document_record(pdf_path, document_id)
+        self.ingest_document_job(document_id)
+        return document_id
 
-            # Create document record
-            document = Document(
-                document_id=document_id,
-                filename=filename,
-                filepath=filepath
-            )
-            
-            self.session.add(document)
-            self.session.commit()
+    def ingest_document_job(self, document_id):
+        """Run the render -> extract -> embed -> store stages for a registered document, tracking its status"""
+        try:
+            with self.db_manager.session_scope() as session:
+                document = session.query(Document).filter(
+                    Document.document_id == document_id
+                ).first()
+                if not document:
+                    raise IngestCancelled(document_id)
+                pdf_path = document.filepath
             
             # Convert PDF to PNG pages and process each page
+            self._update_document(document_id, status=Document.STATUS_RENDERING)
             png_dir = self._create_png_directory(document_id)
-            page_count = self._convert_pdf_to_png(pdf_path, png_dir, document_id)
-            
-            # Collect all PNG filepaths for batch processing
-            png_filepaths = []
-            for page_num in range(1, page_count + 1):
-                png_filename = f"{document_id}_page_{page_num}.png"
-                png_filepath = os.path.join(png_dir, png_filename)
-                
-                if os.path.exists(png_filepath):
-                    png_filepaths.append((page_num, png_filename, png_filepath))
+            # Gambar yang baru dirender langsung dipakai untuk ekstraksi, tanpa dibaca ulang dari disk
+            rendered_pages = self._convert_pdf_to_png(pdf_path, png_dir, document_id)
+            page_count = len(rendered_pages)
+            self._update_document(document_id, page_count=page_count, status=Document.STATUS_EXTRACTING)
             
             # Process all pages in batch for better performance
-            if png_filepaths:
+            if rendered_pages:
                 try:
-                    for page_num, png_filename, png_filepath in png_filepaths:
-                        try:
-                            # Process page with AI extraction (no need for DocumentPage)
-                            extracted_elements = self.ai_processor.process_png_page(png_filepath)
-                            
-                            # Store elements in vector database only
-                            for element_data in extracted_elements:
-                                if element_data['plain_text']:
-                                    embedding = self.ai_processor.generate_embeddings(element_data['plain_text'])
-                                    if embedding:
-                                        self.vector_db.add_element_embedding(
-                                            element_id=f"{document_id}_page_{page_num}_{element_data['element_type']}",
-                                            plain_text=element_data['plain_text'],
-                                            embedding_vector=embedding,
-                                            metadata={
-                                                "document_id": str(document_id),
-                                                "page_number": page_num,
-                                                "element_type": element_data['element_type']
-                                            }
-                                        )
-                            
-                            self.session.commit()
-                            print(f"Page {page_num} processed successfully with {len(extracted_elements)} elements")
-                            
-                        except Exception as e:
-                            print(f"Error processing PNG page {page_num}: {e}")
-                            if self.session:
-                                self.session.rollback()
-                            raise e
+                    # Analyze all pages concurrently (network-bound), results keep page order
+                    all_extracted_elements = self._extract_pages([image for _, image in rendered_pages])
+                    failed_pages = [page_num for (page_num, _), elements in zip(rendered_pages, all_extracted_elements) if elements is None]
+                    if len(failed_pages) == page_count:
+                        raise RuntimeError(f"AI analysis failed for every page of document {document_id}")
+                    if failed_pages:
+                        print(f"AI analysis failed for pages {failed_pages}, continuing with the remaining pages")
+                    
+                    # Collect every element across all pages, then embed them in as few requests as possible
+                    elements_to_embed = []
+                    skipped_count = 0
+                    for (page_num, _), extracted_elements in zip(rendered_pages, all_extracted_elements):
+                        if extracted_elements is None:
+                            continue
+                        for element_data in extracted_elements:
+                            if _is_embeddable(element_data['plain_text']):
+                                elements_to_embed.append((page_num, element_data))
+                            else:
+                                skipped_count += 1
+                        print(f"Page {page_num} processed successfully with {len(extracted_elements)} elements")
+                    if skipped_count:
+                        print(f"Skipped {skipped_count} low-signal elements (too short or mostly non-alphanumeric)")
+                    
+                    self._update_document(document_id, status=Document.STATUS_EMBEDDING)
+                    
+                    # Teks berulang (header, footer, dsb.) cukup di-embed sekali
+                    unique_texts = list(dict.fromkeys(element_data['plain_text'] for _, element_data in elements_to_embed))
+                    embedding_by_text = dict(zip(unique_texts, self.ai_processor.generate_embeddings_batch(unique_texts)))
                     
-                    print(f"Batch processed {len(png_filepaths)} pages successfully")
+                    # Store elements in vector database only, in a single bulk insert
+                    embedded = [
+                        (page_num, element_data, embedding_by_text[element_data['plain_text']])
+                        for page_num, element_data in elements_to_embed
+                        if embedding_by_text[element_data['plain_text']]
+                    ]
+                    plain_texts = [element_data['plain_text'] for _, element_data, _ in embedded]
+                    embedding_vectors = [embedding for _, _, embedding in embedded]
+                    metadatas = [
+                        {
+                            "element_id": f"{document_id}_page_{page_num}_{element_data['element_type']}",
+                            "document_id": str(document_id),
+                            "page_number": page_num,
+                            "element_type": element_data['element_type']
+                        }
+                        for page_num, element_data, _ in embedded
+                    ]
+                    if embedded:
+                        # Salinan matriks embedding untuk pencarian brute-force pada dokumen kecil,
+                        # ditulis di thread terpisah bersamaan dengan insert ke vector database
+                        with ThreadPoolExecutor(max_workers=1) as sidecar_pool:
+                            sidecar_future = sidecar_pool.submit(
+                                self.embedding_store.save, document_id, embedding_vectors, metadatas, plain_texts
+                            )
+                            stored = self.vector_db.add_elements_bulk(
+                                element_ids=[metadata['element_id'] for metadata in metadatas],
+                                plain_texts=plain_texts,
+                                embedding_vectors=embedding_vectors,
+                                metadatas=metadatas
+                            )
+                            sidecar_future.result()
+                        if not stored:
+                            self.embedding_store.delete(document_id)
+                            raise RuntimeError(f"Failed to store embeddings for document {document_id}")
+                    
+                    print(f"Batch processed {page_count} pages successfully")
                     
                 except Exception as e:
                     print(f"Error processing PNG pages batch: {e}")
-                    if self.session:
-                        self.session.rollback()
                     raise e
             
+            self._update_document(document_id, status=Document.STATUS_READY)
             print(f"Document {document_id} processed successfully with {page_count} pages")
             return document_id
             
+        except IngestCancelled:
+            # Dokumen dihapus saat diproses: buang embedding, sidecar dan gambar yang sudah ditulis
+            self._discard_ingest_output(document_id)
+            raise
         except Exception as e:
             print(f"Error processing PDF document: {e}")
-            if self.session:
-                self.session.rollback()
+            try:
+                self._update_document(document_id, status=Document.STATUS_FAILED)
+            except IngestCancelled:
+                self._discard_ingest_output(document_id)
             raise e
 
     def get_document_pages_for_qa(self, document_id):
         """Get all pages for QA processing from vector database"""
         try:
-            # Get pages from vector database metadata
-            results = self.vector_db.collection.get(
-                where={"document_id": document_id},
-                include=["metadatas"]
-            )
+            # Get pages and their texts from the vector database in one call
+            # (plain_text disimpan di field documents, bukan di metadata)
+            results = self.vector_db.get_document_elements(document_id, include=("metadatas", "documents"))
+            if not results:
+                return []
             
-            pages_data = []
-            if results['metadatas']:
-                # Get unique page numbers
-                page_numbers = set()
-                for metadata in results['metadatas']:
-                    page_num = metadata.get('page_number')
-                    if page_num:
-                        page_numbers.add(page_num)
-                
-                # Convert to list and sort
-                for page_num in sorted(page_numbers):
-                    # Get elements for this page
-                    elements = []
-                    for metadata in results['metadatas']:
-                        if metadata.get('page_number') == page_num:
-                            elements.append({
-                                'element_type': metadata.get('element_type', 'UNKNOWN'),
-                                'plain_text': metadata.get('plain_text', ''),
-                                'similarity_score': 1 - metadata.get('distance', 1)
-                            })
-                    
-                    # Add page data with elements
-                    pages_data.append({
-                        'page_number': page_num,
-                        'page_id': page_num,
-                        'elements': elements
+            # Kelompokkan elemen per halaman dalam satu kali iterasi
+            elements_by_page = defaultdict(list)
+            for metadata, plain_text in zip(results['metadatas'] or [], results['documents'] or []):
+                page_num = metadata.get('page_number')
+                if page_num:
+                    elements_by_page[page_num].append({
+                        'element_type': metadata.get('element_type', 'UNKNOWN'),
+                        'plain_text': plain_text or '',
+                        'similarity_score': 1 - metadata.get('distance', 1)
                     })
             
+            pages_data = [
+                {
+                    'page_number': page_num,
+                    'page_id': page_num,
+                    'elements': elements_by_page[page_num]
+                }
+                for page_num in sorted(elements_by_page)
+            ]
+            
             return pages_data
             
         except Exception as e:
@@ -212,6 +401,32 @@ class DocumentProcessor:
             return []
 
     def search_similar_content(self, document_id, query, top_k=5):
+        """
+        Search for similar content, reusing recent results for the same (normalized) question.
+        """
+        cache_key = (document_id, QAHistory.hash_question(query), top_k)
+        with _SEARCH_CACHE_LOCK:
+            cached = _SEARCH_CACHE.get(cache_key)
+            if cached is not None:
+                _SEARCH_CACHE.move_to_end(cache_key)
+                return list(cached)
+        
+        results = self._search_similar_content_uncached(document_id, query, top_k)
+        # Hasil kosong tidak disimpan karena bisa berasal dari kegagalan sementara
+        if results:
+            with _SEARCH_CACHE_LOCK:
+                _SEARCH_CACHE[cache_key] = results
+                _SEARCH_CACHE.move_to_end(cache_key)
+                while len(_SEARCH_CACHE) > Config.SEARCH_CACHE_SIZE:
+                    _SEARCH_CACHE.popitem(last=False)
+        return list(results)
+
+    def _invalidate_search_cache(self, document_id):
+        with _SEARCH_CACHE_LOCK:
+            for cache_key in [key for key in _SEARCH_CACHE if key[0] == document_id]:
+                del _SEARCH_CACHE[cache_key]
+
+    def _search_similar_content_uncached(self, document_id, query, top_k):
         """
         Search for similar content using vector database only.
         """
@@ -220,91 +435,114 @@ class DocumentProcessor:
             if not query_embedding:
                 return []
             
-            # Search in vector database
-            initial_results = self.vector_db.search_similar_elements(
-                query_embedding=query_embedding,
-                document_id=document_id,
-                top_k=top_k
-            )
+            # Small documents: score every element locally in one matrix product;
+            # otherwise (or without a sidecar) search the vector database
+            initial_results = self.embedding_store.query(document_id, query_embedding, top_k)
+            if initial_results is None:
+                initial_results = self.vector_db.search_similar_elements(
+                    query_embedding=query_embedding,
+                    document_id=document_id,
+                    top_k=top_k,
+                    include_documents=True
+                )
             
             if not initial_results or not initial_results.get('metadatas') or not initial_results['metadatas'][0]:
                 return []
             
-            all_similar_elements = []
-            for i, metadata in enumerate(initial_results['metadatas'][0]):
-                similarity_score = 1 - initial_results['distances'][0][i]
-                
-                # Boost flowchart elements
-                element_type = metadata.get('element_type', 'UNKNOWN')
-                if element_type == 'FLOWCHART':
-                    similarity_score *= 1.05
-                    similarity_score = min(similarity_score, 1.0)
-
-                if similarity_score > 0.5:
-                    # Get plain_text from vector database
-                    plain_text = initial_results['documents'][0][i] if initial_results.get('documents') and initial_results['documents'][0] else ""
-                    
-                    all_similar_elements.append({
-                        'element_type': element_type,
-                        'plain_text': plain_text,
-                        'similarity_score': round(similarity_score, 3),
-                        'page_number': metadata.get('page_number'),
-                        'element_id': metadata.get('element_id')
-                    })
-            
-            # Sort by similarity score
-            all_similar_elements.sort(key=lambda x: x['similarity_score'], reverse=True)
+            metadatas = initial_results['metadatas'][0]
+            documents = initial_results['documents'][0] if initial_results.get('documents') and initial_results['documents'][0] else None
             
-            # Get top element per page
-            top_elements_per_page = {}
-            for element in all_similar_elements:
-                page_num = element['page_number']
-                if page_num not in top_elements_per_page:
-                    top_elements_per_page[page_num] = element
-            
-            # Return filtered results
-            final_results = list(top_elements_per_page.values())
-            final_results.sort(key=lambda x: x['similarity_score'], reverse=True)
-            
-            return final_results[:2]
+            # Skor dihitung sekaligus dengan NumPy, lalu diambil elemen terbaik per halaman
+            page_numbers = [metadata.get('page_number') for metadata in metadatas]
+            is_flowchart = np.fromiter(
+                (metadata.get('element_type') == 'FLOWCHART' for metadata in metadatas), dtype=bool, count=len(metadatas)
+            )
+            final_results = []
+            for i, similarity_score in _best_per_page(initial_results['distances'][0], is_flowchart, page_numbers, limit=2):
+                metadata = metadatas[i]
+                final_results.append({
+                    'element_type': metadata.get('element_type', 'UNKNOWN'),
+                    'plain_text': documents[i] if documents else "",
+                    'similarity_score': similarity_score,
+                    'page_number': page_numbers[i],
+                    'element_id': metadata.get('element_id')
+                })
+            return final_results
             
         except Exception as e:
             print(f"Error searching similar content: {e}")
             return []
 
+    def _find_cached_answer(self, document_id, question):
+        """Return the latest successful stored answer for the exact same (normalized) question, if any"""
+        with self.db_manager.session_scope() as session:
+            record = session.query(QAHistory).filter(
+                QAHistory.document_id == document_id,
+                QAHistory.question_hash == QAHistory.hash_question(question),
+                QAHistory.status == QAHistory.STATUS_ANSWERED
+            ).order_by(QAHistory.created_at.desc()).first()
+        
+        if not record:
+            return None
+        return {"answer": record.answer, "similar_elements": record.sources or [], "success": True, "cached": True}
+
     def answer_question(self, document_id, question, top_k=5):
-        """Answer a question based on document content"""
+        """
+        Answer a question based on document content. success is True only for a real Gemini
+        answer (the only kind worth storing and replaying); cached marks an answer replayed from QAHistory.
+        """
         try:
+            # Pertanyaan yang sama persis: pakai jawaban tersimpan tanpa embedding/Gemini
+            cached = self._find_cached_answer(document_id, question)
+            if cached:
+                return cached
+            
             similar_elements = self.search_similar_content(document_id, question, top_k)
             if not similar_elements:
-                return {"answer": "Maaf, tidak ada informasi relevan yang ditemukan.", "similar_elements": []}
+                return {"answer": "Maaf, tidak ada informasi relevan yang ditemukan.", "similar_elements": [], "success": False}
 
             answer = self.ai_processor.answer_question(question, similar_elements)
-            return {"answer": answer, "similar_elements": similar_elements}
+            if answer is None:
+                return {
+                    "answer": "Maaf, terjadi kesalahan saat menghubungi AI. Silakan coba lagi.",
+                    "similar_elements": similar_elements,
+                    "success": False
+                }
+            return {"answer": answer, "similar_elements": similar_elements, "success": True}
             
         except Exception as e:
             print(f"Error answering question: {e}")
-            return {"answer": f"Terjadi kesalahan: {e}", "similar_elements": []}
+            return {"answer": f"Terjadi kesalahan: {e}", "similar_elements": [], "success": False}
 
     def get_document_info(self, document_id):
         """Get basic information about a document"""
         try:
-            document = self.session.query(Document).filter(
-                Document.document_id == document_id
-            ).first()
-            
-            if not document:
-                return None
-            
-            # Get page count from file system
-            page_dir = os.path.join("storage/documents", document_id)
-            page_count = len([f for f in os.listdir(page_dir) if f.endswith('.png')])
+            with self.db_manager.session_scope() as session:
+                document = session.query(Document).filter(
+                    Document.document_id == document_id
+                ).first()
+                
+                if not document:
+                    return None
+                
+                status = document.status or Document.STATUS_READY
+                
+                # Backfill dokumen lama yang belum punya page_count (sekali saja)
+                if document.page_count is None and status == Document.STATUS_READY:
+                    try:
+                        with os.scandir(STORAGE_ROOT / document_id) as entries:
+                            document.page_count = sum(1 for entry in entries if entry.name.endswith(PAGE_IMAGE_EXTENSIONS))
+                    except FileNotFoundError:
+                        # Folder halaman hilang: dokumen tetap ada, jumlah halaman tidak diketahui
+                        pass
+                page_count = document.page_count
             
             return {
                 'document_id': document.document_id,
                 'filename': document.filename,
                 'uploaded_at': document.uploaded_at.isoformat() if document.uploaded_at else None,
-                'page_count': page_count
+                'page_count': page_count,
+                'status': status
             }
             
         except Exception as e:
@@ -316,21 +554,22 @@ class DocumentProcessor:
         try:
             # Delete from vector database first
             self.vector_db.delete_document_embeddings(document_id)
+            self.embedding_store.delete(document_id)
+            self._invalidate_search_cache(document_id)
             
             # Delete from SQL database (cascade will handle related records)
-            document = self.session.query(Document).filter(
-                Document.document_id == document_id
-            ).first()
+            with self.db_manager.session_scope() as session:
+                document = session.query(Document).filter(
+                    Document.document_id == document_id
+                ).first()
+                if document:
+                    session.delete(document)
             
             if document:
-                self.session.delete(document)
-                self.session.commit()
-                
-                # Delete PNG files
-                png_dir = os.path.join("storage/documents", document_id)
-                if os.path.exists(png_dir):
-                    import shutil
-                    shutil.rmtree(png_dir)
+                # Hapus file halaman di background setelah commit, agar pemanggil tidak menunggu I/O
+                png_dir = STORAGE_ROOT / document_id
+                if png_dir.exists():
+                    _CLEANUP_EXECUTOR.submit(shutil.rmtree, png_dir, ignore_errors=True)
                 
                 print(f"Document {document_id} deleted successfully")
                 return True
@@ -340,11 +579,4 @@ class DocumentProcessor:
                 
         except Exception as e:
             print(f"Error deleting document: {e}")
-            if self.session:
-                self.session.rollback()
-            return False
-
-    def __del__(self):
-        """Cleanup when object is destroyed"""
-        if self.session:
-            self.session.close()
\ No newline at end of file
+            return False
\ No newline at end of file
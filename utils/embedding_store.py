@@ -0,0 +1,97 @@
+import os
+import orjson
+import tempfile
+import numpy as np
+
+
+def _write_temp(directory, write):
+    """Write through write(file) to a new, uniquely named temp file in directory and return its path"""
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return tmp_path
+
+
+class EmbeddingStore:
+    """Per-document NumPy sidecar of element embeddings for brute-force cosine search"""
+
+    def __init__(self, store_dir, max_elements):
+        self.store_dir = store_dir
+        # Dokumen yang lebih besar dari ini dicari lewat indeks HNSW Chroma
+        self.max_elements = max_elements
+
+    def _paths(self, document_id):
+        base = os.path.join(self.store_dir, document_id)
+        return f"{base}.npy", f"{base}.json"
+
+    def save(self, document_id, embedding_vectors, metadatas, plain_texts):
+        """Store L2-normalized float32 vectors plus an aligned JSON index; written atomically"""
+        matrix_path, index_path = self._paths(document_id)
+        try:
+            os.makedirs(self.store_dir, exist_ok=True)
+            matrix = np.asarray(embedding_vectors, dtype=np.float32)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            matrix /= np.where(norms == 0, 1, norms)
+
+            # File sementara unik per penulis, bukan per proses (save bisa berjalan dari beberapa thread)
+            tmp_paths = []
+            try:
+                tmp_paths.append(_write_temp(self.store_dir, lambda f: np.save(f, matrix)))
+                tmp_paths.append(_write_temp(
+                    self.store_dir, lambda f: f.write(orjson.dumps({'metadatas': metadatas, 'documents': plain_texts}))
+                ))
+                # Indeks ditulis terakhir: load hanya berhasil bila keduanya lengkap
+                os.replace(tmp_paths[0], matrix_path)
+                os.replace(tmp_paths[1], index_path)
+            finally:
+                for tmp_path in tmp_paths:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+        except Exception as e:
+            print(f"Error writing embedding sidecar for {document_id}: {e}")
+
+    def query(self, document_id, query_embedding, top_k):
+        """
+        Score every element of a document against the query in one matrix product.
+        Returns a Chroma-shaped result dict (cosine distances), or None when no usable sidecar exists
+        or the document is too large for brute force.
+        """
+        matrix_path, index_path = self._paths(document_id)
+        try:
+            matrix = np.load(matrix_path, mmap_mode='r')
+            if not 0 < matrix.shape[0] <= self.max_elements:
+                return None
+            with open(index_path, 'rb') as f:
+                index = orjson.loads(f.read())
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Error reading embedding sidecar for {document_id}: {e}")
+            return None
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        if matrix.shape[0] != len(index['metadatas']) or matrix.shape[1] != query.shape[0]:
+            return None
+        query_norm = np.linalg.norm(query)
+        scores = matrix @ (query / query_norm if query_norm else query)
+
+        top_k = min(top_k, scores.shape[0])
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top])]
+        return {
+            'ids': [[index['metadatas'][i].get('element_id') for i in top]],
+            'distances': [[float(1 - scores[i]) for i in top]],
+            'metadatas': [[index['metadatas'][i] for i in top]],
+            'documents': [[index['documents'][i] for i in top]]
+        }
+
+    def delete(self, document_id):
+        for path in self._paths(document_id):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,76 @@
+import os
+import orjson
+import hashlib
+import tempfile
+from datetime import datetime, timezone
+
+
+class ExtractionCache:
+    """Content-addressable on-disk cache for page extraction results"""
+
+    REQUIRED_KEYS = ('element_type', 'content_json', 'plain_text')
+
+    def __init__(self, cache_dir, provider="gemini"):
+        self.cache_dir = cache_dir
+        self.provider = provider
+
+    def make_key(self, png_data, model, prompt_version):
+        """SHA-256 over the length-prefixed image bytes, provider, model and prompt version"""
+        hasher = hashlib.sha256()
+        hasher.update(len(png_data).to_bytes(8, 'big'))
+        hasher.update(png_data)
+        for part in (self.provider, model, prompt_version):
+            encoded = part.encode('utf-8')
+            hasher.update(len(encoded).to_bytes(8, 'big'))
+            hasher.update(encoded)
+        return hasher.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _is_valid(self, elements):
+        """Check that cached elements still match the shape produced by the extractor"""
+        return isinstance(elements, list) and all(
+            isinstance(element, dict) and all(k in element for k in self.REQUIRED_KEYS)
+            for element in elements
+        )
+
+    def get(self, key):
+        """Return cached elements for key, or None on miss / invalid entry"""
+        try:
+            with open(self._path(key), 'rb') as f:
+                entry = orjson.loads(f.read())
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Error reading extraction cache entry {key}: {e}")
+            return None
+
+        elements = entry.get('elements') if isinstance(entry, dict) else None
+        if not self._is_valid(elements):
+            print(f"Ignoring invalid extraction cache entry {key}")
+            return None
+        return elements
+
+    def put(self, key, elements, model):
+        """Store elements for key; written atomically so readers never see partial files"""
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            entry = {
+                'elements': elements,
+                'model': model,
+                'provider': self.provider,
+                'ts': datetime.now(timezone.utc).isoformat()
+            }
+            # Nama file sementara unik per penulis: thread lain bisa menulis key yang sama (halaman identik)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(orjson.dumps(entry))
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+        except Exception as e:
+            print(f"Error writing extraction cache entry {key}: {e}")
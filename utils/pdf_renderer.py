@@ -0,0 +1,25 @@
+import fitz  # PyMuPDF
+
+# Modul ini sengaja hanya bergantung pada PyMuPDF: worker proses rendering
+# mengimpornya tanpa ikut memuat Chroma, google-genai, atau database
+
+
+def iter_rendered_pages(pdf_document, page_indexes, zoom, image_format, quality):
+    """Yield (page_index, image_bytes) for the given 0-based pages of an open PDF, encoded in memory"""
+    matrix = fitz.Matrix(zoom, zoom)
+    for page_index in page_indexes:
+        pix = pdf_document.load_page(page_index).get_pixmap(matrix=matrix, alpha=False)
+        if image_format == 'webp':
+            # WebP jauh lebih cepat di-encode dan lebih kecil daripada PNG (deflate)
+            yield page_index, pix.pil_tobytes(format='WEBP', quality=quality)
+        elif image_format == 'jpeg':
+            yield page_index, pix.tobytes("jpeg", jpg_quality=quality)
+        else:
+            yield page_index, pix.tobytes("png")
+
+
+def render_pages(pdf_path, page_indexes, zoom, image_format, quality):
+    """Render the given pages to image bytes (top-level so it can run in a worker process)"""
+    # Setiap worker membuka file dari path; page cache OS dipakai bersama antar proses
+    with fitz.open(pdf_path) as pdf_document:
+        return list(iter_rendered_pages(pdf_document, page_indexes, zoom, image_format, quality))
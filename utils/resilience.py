@@ -0,0 +1,228 @@
+import re
+import time
+import logging
+import random
+import asyncio
+import threading
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Status Gemini yang layak dicoba ulang bila exception tidak membawa kode HTTP
+RETRYABLE_STATUSES = ("RESOURCE_EXHAUSTED", "UNAVAILABLE", "INTERNAL", "DEADLINE_EXCEEDED")
+# Error jaringan tanpa respons dari server (koneksi ditolak/putus, timeout)
+TRANSPORT_ERRORS = (httpx.TransportError, TimeoutError, ConnectionError)
+_RETRY_DELAY_PATTERN = re.compile(r"retryDelay['\"]?\s*:\s*['\"]?(\d+(?:\.\d+)?)s")
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at `rate` tokens per second"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def _take_or_wait(self):
+        """Take one token and return 0, or return the seconds until one is available"""
+        with self.lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def try_acquire(self):
+        """Take one token if available; never blocks"""
+        return self._take_or_wait() == 0
+
+    def acquire(self):
+        """Take one token, sleeping only when the bucket is empty"""
+        wait = self._take_or_wait()
+        while wait:
+            time.sleep(wait)
+            wait = self._take_or_wait()
+
+    async def acquire_async(self):
+        """Async variant of acquire"""
+        wait = self._take_or_wait()
+        while wait:
+            await asyncio.sleep(wait)
+            wait = self._take_or_wait()
+
+
+class CircuitBreaker:
+    """
+    Fail fast while an upstream endpoint is down (closed -> open -> half_open -> closed).
+    A half-open trial that never reports back is abandoned after reset_timeout and another is allowed.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_started_at = 0.0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """Whether a call may go through; after the cooldown a single trial call is let through"""
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            now = time.monotonic()
+            if (self.state == self.OPEN and now - self.opened_at >= self.reset_timeout) or \
+                    (self.state == self.HALF_OPEN and now - self.trial_started_at >= self.reset_timeout):
+                self.state = self.HALF_OPEN
+                self.trial_started_at = now
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning("Circuit breaker '%s' opened after %d failures", self.name, self.failures)
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class Retrier:
+    """Retry helper with decorrelated jitter, Retry-After honoring and a shared retry budget"""
+
+    RETRYABLE_CODES = {429, 500, 503, 504}
+
+    def __init__(self, max_retries=3, base_delay=1, max_delay=30, retries_per_minute=60):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # Budget retry per menit agar endpoint yang bermasalah tidak menerima beban berlipat
+        self.budget = TokenBucket(rate=retries_per_minute / 60, capacity=retries_per_minute)
+
+    def is_retryable(self, error):
+        if isinstance(error, TRANSPORT_ERRORS):
+            return True
+        code = getattr(error, 'code', None)
+        if isinstance(code, int):
+            return code in self.RETRYABLE_CODES
+        return any(status in str(error) for status in RETRYABLE_STATUSES)
+
+    def retry_after(self, error):
+        """Server-requested delay in seconds (Retry-After header or RetryInfo.retryDelay), if any"""
+        response = getattr(error, 'response', None)
+        headers = getattr(response, 'headers', None)
+        if headers:
+            value = headers.get('retry-after')
+            if value:
+                try:
+                    return float(value)
+                except ValueError:
+                    pass
+        match = _RETRY_DELAY_PATTERN.search(str(getattr(error, 'details', None) or error))
+        return float(match.group(1)) if match else None
+
+    def next_delay(self, previous_delay, error):
+        """Decorrelated jitter: min(cap, uniform(base, prev * 3)), never shorter than Retry-After"""
+        delay = min(self.max_delay, random.uniform(self.base_delay, previous_delay * 3))
+        server_delay = self.retry_after(error)
+        if server_delay is not None:
+            delay = max(delay, min(server_delay, self.max_delay))
+        return delay
+
+    def _allowed(self, breaker):
+        if breaker is not None and not breaker.allow():
+            logger.warning("Circuit breaker '%s' is open, skipping API call", breaker.name)
+            return False
+        return True
+
+    def _record_failure(self, breaker, error):
+        # Error non-retryable (mis. 400) tidak dihitung sebagai kegagalan endpoint, tapi juga bukan sukses
+        if breaker is not None and (error is None or self.is_retryable(error)):
+            breaker.record_failure()
+
+    def _should_retry(self, attempt, error):
+        if not self.is_retryable(error):
+            logger.warning("Non-retryable error: %s", error)
+            return False
+        if attempt >= self.max_retries - 1:
+            logger.warning("Max retries reached for API error: %s", error)
+            return False
+        if not self.budget.try_acquire():
+            logger.warning("Retry budget exhausted, giving up: %s", error)
+            return False
+        return True
+
+    def call(self, func, breaker=None):
+        """Call func, retrying retryable errors; returns None when all attempts fail or the breaker is open"""
+        delay = self.base_delay
+        for attempt in range(self.max_retries):
+            if not self._allowed(breaker):
+                return None
+            try:
+                result = func()
+            except Exception as e:
+                self._record_failure(breaker, e)
+                if not self._should_retry(attempt, e):
+                    return None
+                delay = self.next_delay(delay, e)
+                logger.info(
+                    "API error (%s), retrying in %.2f seconds... (attempt %d/%d)",
+                    getattr(e, 'code', None) or type(e).__name__, delay, attempt + 1, self.max_retries
+                )
+                time.sleep(delay)
+                continue
+            except BaseException:
+                # KeyboardInterrupt dsb.: jangan biarkan trial half-open menggantung
+                self._record_failure(breaker, None)
+                raise
+            if breaker is not None:
+                breaker.record_success()
+            return result
+        return None
+
+    async def acall(self, func, breaker=None):
+        """Async variant of call for coroutine functions"""
+        delay = self.base_delay
+        for attempt in range(self.max_retries):
+            if not self._allowed(breaker):
+                return None
+            try:
+                result = await func()
+            except Exception as e:
+                self._record_failure(breaker, e)
+                if not self._should_retry(attempt, e):
+                    return None
+                delay = self.next_delay(delay, e)
+                logger.info(
+                    "API error (%s), retrying in %.2f seconds... (attempt %d/%d)",
+                    getattr(e, 'code', None) or type(e).__name__, delay, attempt + 1, self.max_retries
+                )
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # asyncio.CancelledError dsb.: jangan biarkan trial half-open menggantung
+                self._record_failure(breaker, None)
+                raise
+            if breaker is not None:
+                breaker.record_success()
+            return result
+        return None
@@ -1,16 +1,191 @@
+import copy
+import time
+import hashlib
+import functools
+import itertools
+import threading
 import chromadb
+import numpy as np
 from chromadb.config import Settings
+from chromadb import errors as chroma_errors
+try:
+    from chromadb.api.shared_system_client import SharedSystemClient
+except ImportError:  # Chroma < 0.5.x
+    from chromadb.api.client import SharedSystemClient
 from config import Config
 import json
 import uuid
 import os
 import shutil
+import sqlite3
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+class _ReadWriteLock:
+    """Many concurrent readers or one writer; waiting writers block new readers so they are not starved"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+# Error yang menandakan penyimpanan collection rusak/hilang (nama kelas berbeda antar versi Chroma)
+_CORRUPTION_ERRORS = (sqlite3.DatabaseError,) + tuple(
+    getattr(chroma_errors, name) for name in ("InternalError", "InvalidCollectionException", "NotFoundError")
+    if hasattr(chroma_errors, name)
+)
+
+# Satu PersistentClient per path untuk seluruh proses
+_CLIENT_CACHE = {}
+_CLIENT_CACHE_LOCK = threading.Lock()
+
+
+def _persistent_client(path, fresh=False):
+    """Return (client, created) for path, reusing the cached client unless fresh=True (after a reset)"""
+    with _CLIENT_CACHE_LOCK:
+        client = None if fresh else _CLIENT_CACHE.get(path)
+        if client is not None:
+            return client, False
+        client = chromadb.PersistentClient(
+            path=path,
+            settings=Settings(anonymized_telemetry=False, allow_reset=True)
+        )
+        _CLIENT_CACHE[path] = client
+        return client, True
+
+
+def _close_persistent_client(path):
+    """
+    Stop the client for path and drop it from both our cache and Chroma's per-path System cache,
+    so the next _persistent_client(path) opens the files on disk again instead of reusing handles
+    to deleted ones.
+    """
+    with _CLIENT_CACHE_LOCK:
+        client = _CLIENT_CACHE.pop(path, None)
+        if client is not None:
+            try:
+                client._system.stop()
+            except Exception as e:
+                print(f"Error stopping ChromaDB client for {path}: {e}")
+        SharedSystemClient.clear_system_cache()
+
+
+# PRAGMA per koneksi SQLite Chroma; selain journal_mode tidak ada yang tersimpan di file
+_SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-262144",
+    "PRAGMA mmap_size=268435456"
+)
+
+
+def _apply_sqlite_pragmas(conn):
+    """Run _SQLITE_PRAGMAS once per pooled Chroma connection (marked on the connection object)"""
+    if getattr(conn, '_pragmas_applied', False):
+        return
+    # Ditandai lebih dulu agar kegagalan tidak diulang di setiap transaksi
+    conn._pragmas_applied = True
+    try:
+        for pragma in _SQLITE_PRAGMAS:
+            conn.execute(pragma)
+    except Exception as e:
+        print(f"Could not apply SQLite PRAGMAs to ChromaDB connection: {e}")
+
+
+def _remove_entry(entry):
+    """Delete one entry of the vector DB directory (sqlite file or HNSW segment dir)"""
+    try:
+        if entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path)
+        else:
+            os.remove(entry.path)
+    except FileNotFoundError:
+        pass
+
+
+def _clear_directory(path):
+    """Empty path in place, removing its entries in parallel; the directory itself is kept"""
+    with os.scandir(path) as it:
+        entries = list(it)
+    with ThreadPoolExecutor(max_workers=min(8, len(entries) or 1)) as pool:
+        list(pool.map(_remove_entry, entries))
+
+
+@functools.lru_cache(maxsize=1024)
+def _document_where(document_id):
+    """Shared where-filter for one document (treat as read-only)"""
+    return {"document_id": {"$eq": str(document_id)}}
+
+
+def _search_include(include_documents):
+    """Fields fetched per search hit; element texts are opt-in"""
+    if include_documents:
+        return ["metadatas", "distances", "documents"]
+    return ["metadatas", "distances"]
+
+
+def _collection_metadata():
+    """HNSW index settings for the collection; fixed once the collection exists (applied again on reset)"""
+    return {
+        "hnsw:space": "cosine",
+        "hnsw:M": Config.HNSW_M,
+        "hnsw:construction_ef": Config.HNSW_EF_CONSTRUCTION,
+        "hnsw:search_ef": Config.HNSW_EF_SEARCH,
+        "hnsw:batch_size": Config.HNSW_BATCH_SIZE,
+        "hnsw:sync_threshold": Config.HNSW_SYNC_THRESHOLD
+    }
+
 
 class VectorDatabaseManager:
     def __init__(self):
         self.client = None
         self.collection = None
-        self.db_path = os.path.join("storage", "vector_db")
+        self.db_path = Config.VECTOR_DB_PATH
+        # Query/get/count berjalan paralel, add/delete/reset eksklusif
+        self._rwlock = _ReadWriteLock()
+        # ID record: prefix acak sekali per proses + counter, tanpa uuid4 per baris
+        self._id_prefix = uuid.uuid4().hex[:8]
+        self._id_counter = itertools.count()
+        self._search_cache = OrderedDict()
+        self._search_cache_lock = threading.Lock()
+        # Naik di setiap add/delete/reset; hasil query yang dimulai sebelum write tidak disimpan ke cache
+        self._search_generation = 0
+        # Batas atas jumlah record (None = belum diketahui); 0 berarti delete bisa dilewati
+        self._approx_count = None
+        self._count_checked_at = 0.0
         self.initialize_database()
     
     def initialize_database(self):
@@ -20,37 +195,68 @@ class VectorDatabaseManager:
             os.makedirs(self.db_path, exist_ok=True)
             
             # Try to initialize client
-            self.client = chromadb.PersistentClient(
-                path=self.db_path,
-                settings=Settings(allow_reset=True)
-            )
+            self.client, created = _persistent_client(self.db_path)
+            if created:
+                self._tune_sqlite()
             
             # Try to get or create collection
             try:
                 self.collection = self.client.get_or_create_collection(
                     name="document_embeddings",
-                    metadata={"hnsw:space": "cosine"}
+                    metadata=_collection_metadata()
                 )
+                # Tanpa probe count() di sini: akses yang rusak ditangani
+                # _safe_collection_operation, dan is_healthy() tetap memeriksanya
                 print("Vector database initialized successfully")
                 
-                # Test collection access
-                _ = self.collection.count()
-                print("Collection access test successful")
-                
             except Exception as collection_error:
                 print(f"Collection error: {collection_error}")
+                if not self._may_auto_reset(collection_error):
+                    raise
                 # Try to reset collection
                 self._reset_collection()
                 
         except Exception as e:
             print(f"Error initializing vector database: {e}")
+            # Izin, lock, versi, dsb. bukan alasan menghapus data: hanya storage rusak yang di-reset
+            if not self._may_auto_reset(e):
+                raise
             # Try to recover by resetting entire database
             self._reset_database()
     
+    @staticmethod
+    def _may_auto_reset(error):
+        """Whether error is a storage-corruption error that Config allows us to recover from by resetting"""
+        return isinstance(error, _CORRUPTION_ERRORS) and Config.AUTO_RESET_ON_CORRUPTION
+    
+    def _tune_sqlite(self):
+        """
+        Apply bulk-ingest PRAGMAs to Chroma's SQLite store (private API, best effort).
+        Chroma keeps one connection per thread and only journal_mode=WAL persists in the file,
+        so the pool's connect is wrapped to tune every connection it opens, not just this thread's.
+        """
+        try:
+            server = getattr(self.client, '_server', self.client)
+            conn_pool = server._sysdb._conn_pool
+            pool_connect = conn_pool.connect
+            
+            def tuned_connect(*args, **kwargs):
+                conn = pool_connect(*args, **kwargs)
+                _apply_sqlite_pragmas(conn)
+                return conn
+            
+            conn_pool.connect = tuned_connect
+            # Koneksi thread ini langsung disetel (sekaligus mengaktifkan WAL)
+            conn_pool.return_to_pool(conn_pool.connect())
+            print(f"Applied SQLite PRAGMAs to ChromaDB {chromadb.__version__} store")
+        except Exception as e:
+            print(f"Could not tune ChromaDB {chromadb.__version__} SQLite store: {e}")
+    
     def _reset_collection(self):
         """Reset the collection if it's corrupted"""
         try:
             print("Attempting to reset collection...")
+            self._invalidate_search_cache()
             
             # Try to delete and recreate collection
             try:
@@ -62,8 +268,9 @@ class VectorDatabaseManager:
             # Create new collection
             self.collection = self.client.create_collection(
                 name="document_embeddings",
-                metadata={"hnsw:space": "cosine"}
+                metadata=_collection_metadata()
             )
+            self._set_approx_count(0)
             print("Collection reset successful")
             
         except Exception as e:
@@ -74,40 +281,34 @@ class VectorDatabaseManager:
         """Reset entire vector database if initialization fails"""
         try:
             print("Attempting to reset entire vector database...")
+            self._invalidate_search_cache()
             
-            # Close client if exists
-            if self.client:
-                try:
-                    self.client = None
-                except:
-                    pass
+            # Tutup client (dan System Chroma yang di-cache per path) sebelum file-nya dihapus
+            _close_persistent_client(self.db_path)
+            self.client = None
+            self.collection = None
             
-            # Backup and remove old database
-            if os.path.exists(self.db_path):
+            # Store lama dipindah sebagai backup; hapus di tempat hanya bila backup dimatikan
+            if os.path.exists(self.db_path) and Config.PRESERVE_CORRUPT_BACKUP:
                 backup_path = f"{self.db_path}_backup_{uuid.uuid4().hex[:8]}"
-                try:
-                    shutil.move(self.db_path, backup_path)
-                    print(f"Backed up old database to {backup_path}")
-                except Exception as backup_error:
-                    print(f"Backup failed: {backup_error}")
-                    # Try to remove directly
-                    try:
-                        shutil.rmtree(self.db_path)
-                    except:
-                        pass
+                # Bila backup gagal, reset dibatalkan: data lama tidak dihapus tanpa salinan
+                shutil.move(self.db_path, backup_path)
+                print(f"Backed up old database to {backup_path}")
+            elif os.path.exists(self.db_path):
+                _clear_directory(self.db_path)
+                print(f"Cleared old database in {self.db_path}")
             
             # Create fresh database
             os.makedirs(self.db_path, exist_ok=True)
             
-            self.client = chromadb.PersistentClient(
-                path=self.db_path,
-                settings=Settings(allow_reset=True)
-            )
+            self.client, _ = _persistent_client(self.db_path, fresh=True)
+            self._tune_sqlite()
             
             self.collection = self.client.create_collection(
                 name="document_embeddings",
-                metadata={"hnsw:space": "cosine"}
+                metadata=_collection_metadata()
             )
+            self._set_approx_count(0)
             
             print("Vector database reset successful")
             
@@ -116,39 +317,117 @@ class VectorDatabaseManager:
             # Set collection to None to indicate failure
             self.collection = None
     
-    def _safe_collection_operation(self, operation, *args, **kwargs):
-        """Safely execute collection operations with error recovery"""
+    def _safe_collection_operation(self, operation, *args, write=False, **kwargs):
+        """Safely execute collection operations with error recovery; write=True takes the exclusive lock"""
+        lock = self._rwlock.write if write else self._rwlock.read
         try:
             if self.collection is None:
                 raise Exception("Vector DB not initialized.")
             
-            return operation(*args, **kwargs)
+            with lock():
+                return operation(*args, **kwargs)
             
         except Exception as e:
-            error_str = str(e).lower()
-            
-            # Check for specific ChromaDB errors
-            if any(keyword in error_str for keyword in [
-                "nothing found on disk", 
-                "hnsw segment reader", 
-                "corrupted", 
-                "invalid"
-            ]):
-                print(f"ChromaDB corruption detected: {e}")
+            if not isinstance(e, _CORRUPTION_ERRORS):
+                raise e
+            
+            print(f"ChromaDB storage error ({type(e).__name__}): {e}")
+            # Reset menghapus seluruh isi collection, jadi hanya dilakukan bila diizinkan
+            if Config.AUTO_RESET_ON_CORRUPTION:
                 print("Attempting to recover...")
                 
                 try:
-                    self._reset_collection()
+                    with self._rwlock.write():
+                        self._reset_collection()
                     # Retry operation
                     if self.collection is not None:
-                        return operation(*args, **kwargs)
+                        with lock():
+                            return operation(*args, **kwargs)
                 except Exception as recovery_error:
                     print(f"Recovery failed: {recovery_error}")
             
             raise e
 
+    def _add_records(self, ids, documents, embeddings, metadatas):
+        # Satu matriks float32 kontigu, bukan list float Python per dimensi
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        
+        def add_operation():
+            # Chroma membatasi jumlah record per add
+            batch_size = self.client.get_max_batch_size()
+            for start in range(0, len(ids), batch_size):
+                end = start + batch_size
+                self.collection.add(
+                    documents=documents[start:end],
+                    embeddings=embeddings[start:end],
+                    metadatas=metadatas[start:end],
+                    ids=ids[start:end]
+                )
+            if self._approx_count is not None:
+                self._approx_count += len(ids)
+        
+        self._safe_collection_operation(add_operation, write=True)
+        self._invalidate_search_cache()
+
+    def _set_approx_count(self, count):
+        self._approx_count = count
+        self._count_checked_at = time.monotonic()
+
+    def _collection_is_empty(self):
+        """
+        Whether the collection is known to hold no records. Uses the cached upper bound kept by
+        adds (deletes never lower it), re-reading count() when unknown or stale. A stale zero is
+        re-read too: writes this counter does not see (another process) would otherwise skip deletes forever.
+        """
+        stale = time.monotonic() - self._count_checked_at > Config.VECTOR_COUNT_RECONCILE_SECONDS
+        if self._approx_count is None or stale:
+            try:
+                self._safe_collection_operation(lambda: self._set_approx_count(self.collection.count()))
+            except Exception as e:
+                print(f"Error counting vector database records: {e}")
+                self._approx_count = None
+                return False
+        return self._approx_count == 0
+
+    def _invalidate_search_cache(self):
+        with self._search_cache_lock:
+            self._search_generation += 1
+            self._search_cache.clear()
+
+    def _search_cache_key(self, query_embedding, document_id, top_k, include_documents):
+        """Cache key tagged with the current write generation (take it before running the query)"""
+        digest = hashlib.blake2b(query_embedding.tobytes(), digest_size=16).digest()
+        with self._search_cache_lock:
+            generation = self._search_generation
+        return generation, digest, document_id, top_k, include_documents
+
+    def _get_cached_search(self, cache_key):
+        with self._search_cache_lock:
+            entry = self._search_cache.get(cache_key)
+            if entry is None:
+                return None
+            expires_at, result = entry
+            if expires_at < time.monotonic():
+                del self._search_cache[cache_key]
+                return None
+            self._search_cache.move_to_end(cache_key)
+        return copy.deepcopy(result)
+
+    def _put_cached_search(self, cache_key, result):
+        with self._search_cache_lock:
+            # A write happened while the query ran: its result may already be stale
+            if cache_key[0] != self._search_generation:
+                return
+            self._search_cache[cache_key] = (time.monotonic() + Config.VECTOR_SEARCH_CACHE_TTL, copy.deepcopy(result))
+            self._search_cache.move_to_end(cache_key)
+            while len(self._search_cache) > Config.VECTOR_SEARCH_CACHE_SIZE:
+                self._search_cache.popitem(last=False)
+
+    def _next_id(self):
+        return f"el_{self._id_prefix}_{next(self._id_counter)}"
+
     def add_element_embedding(self, element_id, plain_text, embedding_vector, metadata=None):
-        """Adds an element's content embedding to the vector database."""
+        """Adds an element's content embedding to the vector database; True only once it is stored."""
         try:
             # Default metadata
             default_metadata = {
@@ -160,50 +439,105 @@ class VectorDatabaseManager:
             if metadata:
                 default_metadata.update(metadata)
             
-            def add_operation():
-                self.collection.add(
-                    documents=[plain_text],
-                    embeddings=[embedding_vector],
-                    metadatas=[default_metadata],
-                    ids=[str(uuid.uuid4())]
-                )
-            
-            self._safe_collection_operation(add_operation)
+            self._add_records([self._next_id()], [plain_text], [embedding_vector], [default_metadata])
             return True
             
         except Exception as e:
             print(f"Error adding element embedding for element {element_id}: {e}")
             return False
 
-    def search_similar_elements(self, query_embedding, document_id=None, top_k=5):
-        """Searches for top_k most similar elements."""
+    def add_elements_bulk(self, element_ids, plain_texts, embedding_vectors, metadatas=None):
+        """Adds many element embeddings with as few collection.add calls as possible."""
         try:
-            # Build where clause
-            where_clause = {}
-            if document_id:
-                where_clause["document_id"] = {"$eq": str(document_id)}
+            if not element_ids:
+                return True
+            
+            # Default metadata per element, merged with provided metadata
+            all_metadata = []
+            for i, element_id in enumerate(element_ids):
+                element_metadata = {
+                    "element_id": str(element_id),
+                    "content_type": "page_element"
+                }
+                if metadatas and metadatas[i]:
+                    element_metadata.update(metadatas[i])
+                all_metadata.append(element_metadata)
+            
+            ids = [self._next_id() for _ in element_ids]
+            self._add_records(ids, plain_texts, embedding_vectors, all_metadata)
+            return True
+            
+        except Exception as e:
+            print(f"Error adding {len(element_ids)} element embeddings in bulk: {e}")
+            return False
+
+    def search_similar_elements(self, query_embedding, document_id=None, top_k=5, include_documents=False):
+        """Searches for top_k most similar elements; element texts are only returned with include_documents=True."""
+        try:
+            # Filter per dokumen di-cache; tanpa document_id tidak ada filter sama sekali
+            where_clause = _document_where(document_id) if document_id else None
+            query_embedding = np.asarray(query_embedding, dtype=np.float32).reshape(1, -1)
+            
+            cache_key = self._search_cache_key(query_embedding, document_id, top_k, include_documents)
+            include = _search_include(include_documents)
+            cached = self._get_cached_search(cache_key)
+            if cached is not None:
+                return cached
             
             def search_operation():
                 return self.collection.query(
-                    query_embeddings=[query_embedding],
+                    query_embeddings=query_embedding,
                     n_results=top_k,
-                    where=where_clause if where_clause else None,
-                    include=["documents", "metadatas", "distances"]
+                    where=where_clause,
+                    include=include
                 )
             
-            return self._safe_collection_operation(search_operation)
+            result = self._safe_collection_operation(search_operation)
+            self._put_cached_search(cache_key, result)
+            return result
             
         except Exception as e:
             print(f"Error searching similar elements: {e}")
             return None
 
+    def search_batch(self, query_embeddings, document_id=None, top_k=5, include_documents=False):
+        """
+        Searches top_k most similar elements for several query embeddings in one collection.query;
+        result lists are aligned with the rows of query_embeddings.
+        """
+        try:
+            where_clause = _document_where(document_id) if document_id else None
+            # Satu matriks (N, D) float32 kontigu untuk semua query
+            query_embeddings = np.ascontiguousarray(query_embeddings, dtype=np.float32)
+            if query_embeddings.ndim == 1:
+                query_embeddings = query_embeddings.reshape(1, -1)
+            if not len(query_embeddings):
+                return {"ids": [], "distances": [], "metadatas": [], "documents": []}
+
+            def search_operation():
+                return self.collection.query(
+                    query_embeddings=query_embeddings,
+                    n_results=top_k,
+                    where=where_clause,
+                    include=_search_include(include_documents)
+                )
+
+            return self._safe_collection_operation(search_operation)
+
+        except Exception as e:
+            print(f"Error searching {len(query_embeddings)} query embeddings in batch: {e}")
+            return None
+
     def delete_element_embedding(self, element_id):
         """Deletes embedding associated with a specific element_id."""
         try:
+            if self._collection_is_empty():
+                return True
             def delete_operation():
                 self.collection.delete(where={"element_id": {"$eq": str(element_id)}})
             
-            self._safe_collection_operation(delete_operation)
+            self._safe_collection_operation(delete_operation, write=True)
+            self._invalidate_search_cache()
             print(f"Deleted embedding for element {element_id}")
             return True
             
@@ -214,10 +548,13 @@ class VectorDatabaseManager:
     def delete_document_embeddings(self, document_id):
         """Deletes all embeddings associated with a specific document_id."""
         try:
+            if self._collection_is_empty():
+                return True
             def delete_operation():
-                self.collection.delete(where={"document_id": {"$eq": str(document_id)}})
+                self.collection.delete(where=_document_where(document_id))
             
-            self._safe_collection_operation(delete_operation)
+            self._safe_collection_operation(delete_operation, write=True)
+            self._invalidate_search_cache()
             print(f"Deleted all embeddings for document {document_id}")
             return True
             
@@ -240,11 +577,23 @@ class VectorDatabaseManager:
             print(f"Error getting collection stats: {e}")
             return {"error": f"Vector DB error: {str(e)}"}
 
-    def get_collection_data(self, include=["documents", "metadatas", "embeddings"]):
-        """Get all data from collection with error handling"""
+    def get_document_elements(self, document_id, include=("metadatas", "documents")):
+        """Get every record of one document (no similarity ranking); None on error"""
+        try:
+            def get_operation():
+                return self.collection.get(where=_document_where(document_id), include=list(include))
+            
+            return self._safe_collection_operation(get_operation)
+            
+        except Exception as e:
+            print(f"Error getting elements for document {document_id}: {e}")
+            return None
+
+    def get_collection_data(self, include=("documents", "metadatas")):
+        """Get all data from collection with error handling; embeddings are only fetched when listed in include"""
         try:
             def get_operation():
-                return self.collection.get(include=include)
+                return self.collection.get(include=list(include))
             
             return self._safe_collection_operation(get_operation)
             
@@ -258,8 +607,11 @@ class VectorDatabaseManager:
             if self.collection is None:
                 return False
             
-            # Test basic operations
-            _ = self.collection.count()
+            # Test basic operations (read lock: a concurrent reset swaps the collection)
+            with self._rwlock.read():
+                if self.collection is None:
+                    return False
+                self._set_approx_count(self.collection.count())
             return True
             
         except Exception as e:
@@ -270,7 +622,8 @@ class VectorDatabaseManager:
         """Force reset the entire vector database"""
         try:
             print("Force resetting vector database...")
-            self._reset_database()
+            with self._rwlock.write():
+                self._reset_database()
             return self.is_healthy()
         except Exception as e:
             print(f"Force reset failed: {e}")
@@ -282,10 +635,12 @@ class VectorDatabaseManager:
             if not self.is_healthy():
                 return {"error": "Vector database not healthy"}
             
-            # Get all embeddings for this document
-            results = self.collection.get(
-                where={"document_id": document_id},
-                include=["metadatas", "embeddings"]
+            # Metadata saja: statistik tidak memakai vektor embedding
+            results = self._safe_collection_operation(
+                lambda: self.collection.get(
+                    where=_document_where(document_id),
+                    include=["metadatas"]
+                )
             )
             
             if not results['ids']:
@@ -321,4 +676,10 @@ class VectorDatabaseManager:
             
         except Exception as e:
             print(f"Error getting document stats: {e}")
-            return {"error": str(e)}
\ No newline at end of file
+            return {"error": str(e)}
+
+
+@functools.lru_cache(maxsize=1)
+def get_vector_db():
+    """Process-wide VectorDatabaseManager, so the Chroma client is opened only once"""
+    return VectorDatabaseManager()